@@ -1,3 +1,9 @@
+from dotenv import load_dotenv
+
+# Загружаем переменные окружения из файла .env до импорта модулей,
+# которые читают настройки при импорте
+load_dotenv()
+
 import firebase_admin
 from firebase_admin import credentials, firestore
 from flask import Flask
@@ -7,12 +13,11 @@ from controllers.routes import guest_routes
 from controllers.routes import event_routes
 from controllers.routes import music_routes
 from controllers.routes import playlist_routes
-from dotenv import load_dotenv
+from auth.signing_keys import signing_keys, session_cookie_keys
+from auth.utils import session_mode_enabled
+from auth.username_filter import username_filter
 import os
 
-# Загружаем переменные окружения из файла .env
-load_dotenv()
-
 # Инициализация Flask
 app = Flask(__name__)
 
@@ -29,6 +34,21 @@ db = firestore.client()
 # Добавляем клиент Firestore в объект приложения
 app.db = db
 
+# Ключи подписи ID-токенов держим в памяти: из локального файла (для офлайн-бенчмарков)
+# или с фоновым обновлением из Google по Cache-Control
+signing_keys_file = os.getenv('FIREBASE_SIGNING_KEYS_FILE')
+if signing_keys_file:
+    signing_keys.load_from_file(signing_keys_file)
+else:
+    signing_keys.start_refresher()
+
+# В режиме сессионных кук их ключи тоже держим в памяти
+if session_mode_enabled():
+    session_cookie_keys.start_refresher()
+
+# Прогреваем Bloom-фильтр занятых username в фоне, до этого проверки идут в Firestore
+username_filter.warm_in_background(db)
+
 # Регистрация маршрутов авторизации
 app.register_blueprint(auth_routes)
 app.register_blueprint(guest_routes)
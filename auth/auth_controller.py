@@ -1,34 +1,39 @@
-import requests
 from flask import request, jsonify, g, make_response, current_app
 from pydantic import ValidationError
 from models.user import UserCreate
 from services.exception_handler import default_error_response, validation_error_response, firebase_error_response
 from services.response_handler import default_response
-from auth.utils import refresh_token_method
+from auth.utils import refresh_token_method, verify_id_token_cached, verify_request_cookie, set_session_cookie, SESSION_COOKIE_NAME
+from auth.identity_client import identity_client
+from auth.token_cache import token_cache
+from auth.usernames import is_username_available, create_user_with_username, rename_username, UsernameTakenError
+from auth.username_filter import username_filter
+from auth.email_queue import email_queue
+from services.rate_limiter import rate_limiter
+from services.validation import is_admin
+from services.profile_cache import get_user_profile, invalidate_user_profile
 from firebase_admin import credentials, auth, firestore
 import logging
 import os
 
 logging.basicConfig(level=logging.DEBUG)
 
-# Получаем ключ API из переменных окружения
-FIREBASE_API_KEY = os.getenv('FIREBASE_API_KEY')
-
 def check_user():
     id_token = request.cookies.get('firebase_token')
+    session_cookie = request.cookies.get(SESSION_COOKIE_NAME)
 
-    if not id_token:
+    if not id_token and not session_cookie:
         return jsonify({"error": "Missing id_token"}), 401
 
     try:
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = verify_request_cookie()
         user_id = decoded_token['uid']
         email_verified = decoded_token.get("email_verified", False)
 
         # Получаем username из базы данных
         db = current_app.db
-        user_doc = db.collection('users').document(user_id).get()
-        username = user_doc.get('username') if user_doc.exists else None
+        profile = get_user_profile(db, user_id)
+        username = profile.get('username') if profile else None
 
         # Возвращаем тот же формат, что и sign_in_cookie
         return jsonify({
@@ -37,14 +42,14 @@ def check_user():
             "is_account_confirmed": email_verified
         }), 200
 
-    except auth.ExpiredIdTokenError:
+    except (auth.ExpiredIdTokenError, auth.ExpiredSessionCookieError):
         # Токен устарел, фронтенд должен вызвать signInCookie()
         return jsonify({
             "error": "Token expired",
             "code": "TOKEN_EXPIRED"
         }), 401
 
-    except auth.InvalidIdTokenError:
+    except (auth.InvalidIdTokenError, auth.InvalidSessionCookieError):
         # Невалидный токен, фронтенд должен разлогинить
         return jsonify({
             "error": "Invalid token",
@@ -60,16 +65,17 @@ def check_user():
 
 def sign_in_cookie():
     id_token = request.cookies.get('firebase_token')
+    session_cookie = request.cookies.get(SESSION_COOKIE_NAME)
 
     print ("Token:", id_token)
     
-    if not id_token:
+    if not id_token and not session_cookie:
         print ("Missing id_token")
         return firebase_error_response("Missing id_token", 401)
 
     try:
-        # Проверяем и декодируем токен
-        decoded_token = auth.verify_id_token(id_token)
+        # Проверяем и декодируем токен (или сессионную куку)
+        decoded_token = verify_request_cookie()
         
         # Получаем uid из токена
         user_id = decoded_token['uid']
@@ -77,8 +83,8 @@ def sign_in_cookie():
 
          # Получаем username из базы данных
         db = current_app.db
-        user_doc = db.collection('users').document(user_id).get()
-        username = user_doc.get('username') if user_doc.exists else None
+        profile = get_user_profile(db, user_id)
+        username = profile.get('username') if profile else None
             
         # Возвращаем ail
         resp = make_response(jsonify({
@@ -104,7 +110,7 @@ def sign_in_with_google():
         if not id_token or not refresh_token:
             return firebase_error_response("Missing idToken or refreshToken", 400)
 
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = verify_id_token_cached(id_token)
         user_id = decoded_token['uid']
         email_verified = decoded_token.get("email_verified", False)
         email = decoded_token.get("email")
@@ -114,22 +120,10 @@ def sign_in_with_google():
 
         db = current_app.db
 
-        existing_user = db.collection('users').document(user_id).get()
+        existing_user = get_user_profile(db, user_id)
         username = None
-        if not existing_user.exists:
-            username = email.split('@')[0]
-            username_check = check_username({"username": username})
-            if not username_check['available']:
-                username += user_id[:6]
-
-            user_data = {
-                "email": email,
-                "username": username,
-                "email_lower": email.lower(),
-                "username_lower": username.lower()
-            }
-
-            add_user_result = add_user(user_data, db, user_id)
+        if existing_user is None:
+            username, add_user_result = add_google_user(db, user_id, email)
             if add_user_result[1] != 201:
                 remove_user_from_firebase(id_token)
                 return add_user_result
@@ -143,23 +137,24 @@ def sign_in_with_google():
             "is_account_confirmed": email_verified
         }), 200)
 
-        # Устанавливаем HttpOnly куки
-        resp.set_cookie(
-            'firebase_token',
-            id_token,
-            httponly=True,
-            secure=False,  # включи HTTPS
-            samesite='Lax',
-            max_age=60 * 60  # 1 час
-        )
-        resp.set_cookie(
-            'refresh_token',
-            refresh_token,
-            httponly=True,
-            secure=False,
-            samesite='Lax',
-            max_age=60 * 60 * 24 * 30  # 30 дней
-        )
+        # Устанавливаем HttpOnly куки (в режиме session - одну сессионную куку)
+        if not set_session_cookie(resp, id_token):
+            resp.set_cookie(
+                'firebase_token',
+                id_token,
+                httponly=True,
+                secure=False,  # включи HTTPS
+                samesite='Lax',
+                max_age=60 * 60  # 1 час
+            )
+            resp.set_cookie(
+                'refresh_token',
+                refresh_token,
+                httponly=True,
+                secure=False,
+                samesite='Lax',
+                max_age=60 * 60 * 24 * 30  # 30 дней
+            )
 
         return resp
 
@@ -175,8 +170,8 @@ def sign_in(data):
     password = data['password']
     
     try:
-        response = requests.post(
-            f'https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={FIREBASE_API_KEY}', 
+        response = identity_client.post(
+            'signInWithPassword',
             json={"email": email, "password": password, "returnSecureToken": True}
         )
 
@@ -191,14 +186,14 @@ def sign_in(data):
         refresh_token = response_data["refreshToken"]
 
         # Декодируем токен
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = verify_id_token_cached(id_token)
         email_verified = decoded_token.get("email_verified", False)
         user_id = decoded_token['uid']
         
         # Получаем username из базы данных
         db = current_app.db
-        user_doc = db.collection('users').document(user_id).get()
-        username = user_doc.get('username') if user_doc.exists else None
+        profile = get_user_profile(db, user_id)
+        username = profile.get('username') if profile else None
 
         # Формируем ответ с куками
         resp = make_response(jsonify({
@@ -206,8 +201,9 @@ def sign_in(data):
             "username": username,
             "is_account_confirmed": email_verified
         }), 200)
-        resp.set_cookie('firebase_token', id_token, httponly=True, samesite='Lax', secure=False)
-        resp.set_cookie('refresh_token', refresh_token, httponly=True, samesite='Lax', secure=False)
+        if not set_session_cookie(resp, id_token):
+            resp.set_cookie('firebase_token', id_token, httponly=True, samesite='Lax', secure=False)
+            resp.set_cookie('refresh_token', refresh_token, httponly=True, samesite='Lax', secure=False)
         
 
         return resp
@@ -220,6 +216,7 @@ def sign_out():
     resp = make_response("Cookies deleted")
     resp.set_cookie('firebase_token', '', max_age=0, httponly=True, samesite='Lax', secure=False)
     resp.set_cookie('refresh_token', '', max_age=0, httponly=True, samesite='Lax', secure=False)
+    resp.set_cookie(SESSION_COOKIE_NAME, '', max_age=0, httponly=True, samesite='Lax', secure=False)
     return resp
 
 
@@ -231,17 +228,22 @@ def register(data):
     if not username:  # Теперь это точно словарь
         print("Не передан username")
         return default_error_response("Не передан username", 500)
-    # Проверяем доступность имени пользователя
-    username_check = check_username(data)
-    print("usernamecheck:", username_check['available'])
-    if not username_check['available']:  # Теперь это точно словарь
+    # Проверяем доступность имени пользователя по индексу usernames, без Bloom-фильтра:
+    # фильтр воркера может не знать имен, занятых в других процессах
+    try:
+        username_available = is_username_available(current_app.db, username)
+    except Exception as e:
+        print(f"Ошибка проверки username: {e}")
+        return default_error_response(str(e), 500)
+    print("usernamecheck:", username_available)
+    if not username_available:
         return firebase_error_response("USERNAME_EXISTS", 400)
     
     # Регистрация в Firebase
     try:
         # Отправляем запрос в Firebase для создания пользователя
-        response = requests.post(
-            f'https://identitytoolkit.googleapis.com/v1/accounts:signUp?key={FIREBASE_API_KEY}', 
+        response = identity_client.post(
+            'signUp',
             json={"email": email, "password": password, "returnSecureToken": True}
         )
         response_data = response.json()
@@ -265,8 +267,6 @@ def register(data):
             "username_lower": username.lower()
         }
 
-        email_verify(id_token)
-
         # Теперь добавляем пользователя в Firestore
         db = current_app.db
         add_user_result = add_user(user_data, db, user_id)  # Передаем user_id в функцию add_user
@@ -277,6 +277,10 @@ def register(data):
             remove_user_from_firebase(id_token)
             return add_user_result  # Возвращаем ошибку, если добавление в базу не удалось
 
+        # Письмо шлем, только когда пользователь точно создан; в фоне, а при переполненной очереди - синхронно
+        if not email_queue.enqueue({"requestType": "VERIFY_EMAIL", "idToken": id_token}):
+            email_verify(id_token)
+
         # Создаем ответ
         resp = make_response(jsonify({"user": email}), 200)
 
@@ -293,6 +297,27 @@ def register(data):
         return default_error_response(str(e), 500)
 
 
+def get_stats():
+    """
+    Счетчики процесса для операторов (только для админов): попадания кеша токенов, отказы rate limiter и состояние фильтра username.
+    Каждый воркер отдает свои счетчики.
+    """
+    try:
+        user_id = g.user.get("uid")
+        if not is_admin(user_id, current_app.db):
+            return default_error_response("Access denied", 403)
+
+        return jsonify({
+            "pid": os.getpid(),
+            "tokenCache": token_cache.stats(),
+            "rateLimiter": rate_limiter.stats(),
+            "usernameFilter": username_filter.stats(),
+        }), 200
+
+    except Exception as e:
+        return default_error_response(str(e), 500)
+
+
 def check_username(data):
     username = data['username']
     db = current_app.db
@@ -302,15 +327,12 @@ def check_username(data):
         return default_error_response("Не передан username", 500)
     
     try:
-        # Запрос к коллекции "users" для поиска документа с данным username
-        users_ref = db.collection('users')
-        query = users_ref.where('username', '==', username).limit(1).stream()
+        # Имени точно нет в Bloom-фильтре - отвечаем без обращения к Firestore
+        if username_filter.definitely_available(username):
+            return {"available": True}
 
-         # Если документ найден, то возвращаем False, иначе True
-        for user in query:
-            return {"available": False}  # Username already exists
-
-        return {"available": True}  # Username is available
+        # Возможное совпадение: одно чтение usernames/{username_lower}
+        return {"available": is_username_available(db, username)}
 
 
     except Exception as e:
@@ -326,33 +348,28 @@ def update_username(data):
         return default_error_response("Не передан user_id или username", 400)
     
     try:
-        # 1. Получаем текущего пользователя
-        user_ref = db.collection('users').document(user_id)
-        current_user = user_ref.get()
-        
-        if not current_user.exists:
+        # Проверка, освобождение старого имени, захват нового и обновление users - одна транзакция
+        result = rename_username(db, user_id, new_username)
+
+        if result == "not_found":
             return default_error_response("Пользователь не найден", 404)
-            
-        current_data = current_user.to_dict()
-        current_username = current_data.get('username')
-        
-        # 2. Если имя не изменилось, просто возвращаем успех
-        if current_username == new_username:
+
+        # Если имя не изменилось, просто возвращаем успех
+        if result == "unchanged":
             return {"success": True, "message": "Username не изменен"}
-        
-        # 3. Проверяем, занято ли новое имя другим пользователем
-        users_ref = db.collection('users')
-        query = users_ref.where('username', '==', new_username).limit(1).stream()
-        
-        for user in query:
-            if user.id != user_id:  # Если нашли другого пользователя с таким именем
-                return {"available": False, "message": "Username уже занят"}
-        
-        # 4. Обновляем username
-        user_ref.update({'username': new_username})
-        
+
+        if result == "taken":
+            return {"available": False, "message": "Username уже занят"}
+
+        # Старое имя остается в фильтре: это лишь лишняя проверка в Firestore, а не ошибка
+        username_filter.add(new_username)
+        invalidate_user_profile(user_id)
+
         return {"success": True, "available": True, "message": "Username успешно изменен"}
-        
+
+    except ValueError:
+        return {"available": False, "message": "Недопустимый username"}
+
     except Exception as e:
         print(f"Ошибка при изменении username: {e}")
         return default_error_response(str(e), 500)
@@ -385,8 +402,8 @@ def email_verify(id_token):
     # Регистрация в Firebase
     try:
         # Отправляем email для подтверждения
-        email_verify_response = requests.post(
-            f'https://identitytoolkit.googleapis.com/v1/accounts:sendOobCode?key={FIREBASE_API_KEY}',
+        email_verify_response = identity_client.post(
+            'sendOobCode',
             json={"requestType": "VERIFY_EMAIL", "idToken": id_token}
         )
         email_verify_data = email_verify_response.json()
@@ -417,8 +434,8 @@ def confirm():
 
     # After adding this verification, the email started getting confirmed successfully!!
     try:
-        verify_response = requests.post(
-            f'https://identitytoolkit.googleapis.com/v1/accounts:update?key={FIREBASE_API_KEY}',
+        verify_response = identity_client.post(
+            'update',
             json={"oobCode": oob_code}
         )
         if verify_response.status_code != 200:
@@ -436,8 +453,8 @@ def confirm():
         return firebase_error_response("No refresh_token found", 401)
 
     try:
-        refresh_response = requests.post(
-            f'https://securetoken.googleapis.com/v1/token?key={FIREBASE_API_KEY}',
+        refresh_response = identity_client.post(
+            'token',
             data={'grant_type': 'refresh_token', 'refresh_token': refresh_token}
         )
         if refresh_response.status_code != 200:
@@ -454,8 +471,9 @@ def confirm():
 
         # Устанавливаем новые куки
         resp = make_response(jsonify({"message": "Email confirmation successful!"}))
-        resp.set_cookie('firebase_token', new_id_token, httponly=True, samesite='Lax', secure=False)
-        resp.set_cookie('refresh_token', new_refresh_token, httponly=True, samesite='Lax', secure=False)
+        if not set_session_cookie(resp, new_id_token):
+            resp.set_cookie('firebase_token', new_id_token, httponly=True, samesite='Lax', secure=False)
+            resp.set_cookie('refresh_token', new_refresh_token, httponly=True, samesite='Lax', secure=False)
         print("Новые токены установлены.")
 
         return resp
@@ -487,14 +505,18 @@ def send_email_password_reset():
             print("Email не найден в коллекции users:", email)
             return firebase_error_response("Email not found", 404)
 
+        reset_payload = {
+            "requestType": "PASSWORD_RESET",
+            "email": email
+        }
+
+        # Ставим письмо в фоновую очередь; если она переполнена - отправляем синхронно
+        if email_queue.enqueue(reset_payload):
+            print("Письмо для сброса пароля поставлено в очередь для:", email)
+            return jsonify({"message": "Password reset email sent."}), 200
+
         # Отправляем запрос на сброс пароля в Firebase
-        reset_response = requests.post(
-            f'https://identitytoolkit.googleapis.com/v1/accounts:sendOobCode?key={FIREBASE_API_KEY}',
-            json={
-                "requestType": "PASSWORD_RESET",
-                "email": email
-            }
-        )
+        reset_response = identity_client.post('sendOobCode', json=reset_payload)
 
         if reset_response.status_code != 200:
             print("Ошибка отправки письма:", reset_response.json())
@@ -517,8 +539,8 @@ def reset_password():
         return make_response(jsonify({"error": "Missing oobCode or newPassword"}), 400)
 
     try:
-        reset_response = requests.post(
-            f'https://identitytoolkit.googleapis.com/v1/accounts:resetPassword?key={FIREBASE_API_KEY}',
+        reset_response = identity_client.post(
+            'resetPassword',
             json={
                 "oobCode": oob_code,
                 "newPassword": new_password
@@ -543,7 +565,7 @@ def verify_token(data):
         id_token = data.get('idToken')
 
         # Проверяем токен через Firebase
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = verify_id_token_cached(id_token)
         uid = decoded_token['uid']
 
         # Возвращаем информацию о пользователе, если токен валиден
@@ -558,22 +580,69 @@ def verify_token(data):
         return firebase_error_response(str(e), 401)
 
 
+def _create_user(data, db, user_id):
+    # Валидация данных с использованием модели Pydantic
+    user_data = UserCreate(**data)
+
+    # Документ users/{user_id} и запись в индексе usernames создаются в одной транзакции
+    user_ref = create_user_with_username(db, user_id, user_data.dict())
+    username_filter.add(user_data.username)
+    invalidate_user_profile(user_id)
+    return user_ref
+
+def _google_username_candidates(email, user_id):
+    # Имя из email, затем оно же с частью uid, в крайнем случае сам uid.
+    # '/' не может быть в ID документа usernames, поэтому заменяем его
+    base = email.split('@')[0].replace('/', '_')
+    return [base, base + user_id[:6], base + user_id, user_id]
+
+def add_google_user(db, user_id, email):
+    """
+    Создает профиль пользователя, вошедшего через Google, занимая первое свободное имя
+    через ту же транзакцию, что и при регистрации. Возвращает (username, ответ как у add_user).
+    """
+    for username in _google_username_candidates(email, user_id):
+        user_data = {
+            "email": email,
+            "username": username,
+            "email_lower": email.lower(),
+            "username_lower": username.lower()
+        }
+        try:
+            user_ref = _create_user(user_data, db, user_id)
+        except ValidationError as e:
+            # ValidationError - тоже ValueError, поэтому ловим его раньше
+            return username, validation_error_response(str(e.errors()), 400)
+        except (UsernameTakenError, ValueError):
+            # Имя занято (в том числе параллельно) или недопустимо - пробуем следующее
+            continue
+        except Exception as e:
+            print("Другая ошибка при попытке добавить юзера Google")
+            return username, default_error_response(str(e), 500)
+
+        return username, (jsonify({"id": user_ref.id, "message": "Юзер успешно добавлен!"}), 201)
+
+    return None, firebase_error_response("USERNAME_EXISTS", 400)
+
 def add_user(data, db, user_id):
     try:
-        # Валидация данных с использованием модели Pydantic
-        user_data = UserCreate(**data)
-
-        # Добавление документа в коллекцию "users" Firestore с использованием user_id как ID
-        user_ref = db.collection('users').document(user_id)
-        user_ref.set(user_data.dict())  # Используем set() для создания/обновления документа с конкретным ID
+        user_ref = _create_user(data, db, user_id)
 
         return jsonify({"id": user_ref.id, "message": "Юзер успешно добавлен!"}), 201
 
+    except UsernameTakenError:
+        print("Username занят при попытке добавить юзера")
+        return firebase_error_response("USERNAME_EXISTS", 400)
+
     except ValidationError as e:
         print("Ошибка валидации при попытке добавить юзера")
         # Возвращаем ошибки валидации, если данные не проходят проверку
         return validation_error_response(str(e.errors()), 400)
 
+    except ValueError as e:
+        print("Недопустимый username при попытке добавить юзера")
+        return validation_error_response(str(e), 400)
+
     except Exception as e:
         print("Другая ошибка при попытке добавить юзера")
         return default_error_response(str(e), 500)
@@ -582,8 +651,8 @@ def remove_user_from_firebase(id_token):
     # Функция для удаления пользователя из Firebase с использованием idToken
     try:
         # Удаляем пользователя из Firebase с помощью REST API, передавая idToken
-        response = requests.post(
-            f'https://identitytoolkit.googleapis.com/v1/accounts:delete?key={FIREBASE_API_KEY}',
+        response = identity_client.post(
+            'delete',
             json={"idToken": id_token}  # Передаем токен авторизации, а не user_id
         )
         
@@ -0,0 +1,148 @@
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from auth.identity_client import identity_client
+
+logger = logging.getLogger(__name__)
+
+
+class EmailSendError(Exception):
+    def __init__(self, message, retryable):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class IdentityToolkitSender:
+    # Отправка писем через accounts:sendOobCode
+    def send(self, payload):
+        response = identity_client.post('sendOobCode', json=payload)
+        if response.status_code == 200:
+            return
+
+        try:
+            message = response.json().get('error', {}).get('message', response.text)
+        except ValueError:
+            message = response.text
+        # 429 и 5xx - временные ошибки, остальные повторять бессмысленно (например, INVALID_ID_TOKEN)
+        raise EmailSendError(message, retryable=response.status_code == 429 or response.status_code >= 500)
+
+
+class StubSender:
+    # Локальная заглушка: ничего не отправляет, только запоминает письма (для офлайн-тестов)
+    def __init__(self):
+        self.sent = []
+
+    def send(self, payload):
+        self.sent.append(payload)
+        print(f"[stub] Письмо {payload.get('requestType')} помечено как отправленное (без реальной отправки)")
+
+
+class EmailDispatchQueue:
+    """
+    Фоновая очередь отправки писем (подтверждение email, сброс пароля).
+    Поток запроса только кладет задачу в очередь; пул воркеров отправляет ее
+    с повторами, а задачи, которые так и не удалось отправить, пишутся в лог как dead letter.
+    """
+
+    def __init__(self, sender, workers=2, capacity=1000, max_attempts=3, backoff=1.0):
+        self.sender = sender
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.enqueued = 0
+        self.sent = 0
+        self.retried = 0
+        self.rejected = 0
+        self.dead_letters = 0
+        self._queue = queue.Queue(maxsize=capacity)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def enqueue(self, payload):
+        # False - очередь переполнена, вызывающий код решает, отправлять ли синхронно
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(payload)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def join(self):
+        # Дождаться обработки всех задач (для тестов и корректной остановки)
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enqueued": self.enqueued,
+                "sent": self.sent,
+                "retried": self.retried,
+                "rejected": self.rejected,
+                "dead_letters": self.dead_letters,
+                "queued": self._queue.qsize(),
+                "workers": len(self._threads),
+            }
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'email-dispatch-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            payload = self._queue.get()
+            try:
+                self._deliver(payload)
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, payload):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.sender.send(payload)
+                with self._lock:
+                    self.sent += 1
+                return
+            except Exception as e:
+                retryable = getattr(e, 'retryable', True)
+                if not retryable or attempt == self.max_attempts:
+                    self._dead_letter(payload, e, attempt)
+                    return
+
+                with self._lock:
+                    self.retried += 1
+                time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def _dead_letter(self, payload, error, attempts):
+        with self._lock:
+            self.dead_letters += 1
+        # idToken в лог не пишем
+        safe_payload = {key: value for key, value in payload.items() if key != 'idToken'}
+        logger.error("Письмо не отправлено после %s попыток: %s, ошибка: %s", attempts, safe_payload, error)
+
+
+def _make_sender():
+    if os.getenv('EMAIL_SENDER', 'identity_toolkit') == 'stub':
+        return StubSender()
+    return IdentityToolkitSender()
+
+
+email_queue = EmailDispatchQueue(
+    _make_sender(),
+    workers=int(os.getenv('EMAIL_QUEUE_WORKERS', 2)),
+    capacity=int(os.getenv('EMAIL_QUEUE_CAPACITY', 1000)),
+)
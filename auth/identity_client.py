@@ -0,0 +1,110 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+
+IDENTITY_TOOLKIT_URL = 'https://identitytoolkit.googleapis.com/v1/accounts:'
+SECURETOKEN_URL = 'https://securetoken.googleapis.com/v1/token'
+
+# Статусы, при которых имеет смысл повторить запрос
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# endpoint -> (url, (connect timeout, read timeout), можно ли безопасно повторять запрос)
+ENDPOINTS = {
+    'signInWithPassword': (IDENTITY_TOOLKIT_URL + 'signInWithPassword', (3, 10), True),
+    'signUp': (IDENTITY_TOOLKIT_URL + 'signUp', (3, 10), False),
+    'sendOobCode': (IDENTITY_TOOLKIT_URL + 'sendOobCode', (3, 15), False),
+    'update': (IDENTITY_TOOLKIT_URL + 'update', (3, 10), False),
+    'resetPassword': (IDENTITY_TOOLKIT_URL + 'resetPassword', (3, 10), False),
+    'delete': (IDENTITY_TOOLKIT_URL + 'delete', (3, 10), True),
+    'token': (SECURETOKEN_URL, (3, 5), True),
+}
+
+
+class IdentityClient:
+    """
+    Общий HTTP-клиент для Identity Toolkit и securetoken:
+    keep-alive пул соединений, таймауты по endpoint, ограниченные повторы с jitter
+    и метрики задержки по каждому вызову.
+    """
+
+    def __init__(self, pool_size=20, max_retries=2, backoff=0.2):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def post(self, endpoint, json=None, data=None):
+        url, timeout, idempotent = ENDPOINTS[endpoint]
+        # Ключ читаем при вызове: .env загружается уже после импорта модулей
+        params = {'key': os.getenv('FIREBASE_API_KEY')}
+
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.session.post(url, params=params, json=json, data=data, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(endpoint, time.perf_counter() - start, error=True)
+                # Неидемпотентный запрос повторяем, только если он точно не ушел на сервер
+                retryable = idempotent or isinstance(e, requests.ConnectTimeout)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+            else:
+                self._record(endpoint, time.perf_counter() - start, error=response.status_code >= 500)
+                if not idempotent or response.status_code not in RETRYABLE_STATUSES or attempt >= self.max_retries:
+                    return response
+
+            attempt += 1
+            self._record_retry(endpoint)
+            # Экспоненциальная задержка с full jitter
+            time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def stats(self):
+        with self._lock:
+            result = {}
+            for endpoint, metric in self._metrics.items():
+                latencies = sorted(metric['recent'])
+                result[endpoint] = {
+                    "calls": metric['calls'],
+                    "errors": metric['errors'],
+                    "retries": metric['retries'],
+                    "avg_ms": round(metric['total_ms'] / metric['calls'], 1) if metric['calls'] else 0.0,
+                    "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 1) if latencies else 0.0,
+                    "max_ms": round(metric['max_ms'], 1),
+                }
+            return result
+
+    def _metric(self, endpoint):
+        metric = self._metrics.get(endpoint)
+        if metric is None:
+            metric = {"calls": 0, "errors": 0, "retries": 0, "total_ms": 0.0, "max_ms": 0.0, "recent": deque(maxlen=500)}
+            self._metrics[endpoint] = metric
+        return metric
+
+    def _record(self, endpoint, elapsed, error):
+        elapsed_ms = elapsed * 1000
+        with self._lock:
+            metric = self._metric(endpoint)
+            metric['calls'] += 1
+            metric['errors'] += 1 if error else 0
+            metric['total_ms'] += elapsed_ms
+            metric['max_ms'] = max(metric['max_ms'], elapsed_ms)
+            metric['recent'].append(elapsed_ms)
+
+    def _record_retry(self, endpoint):
+        with self._lock:
+            self._metric(endpoint)['retries'] += 1
+
+
+# Общий клиент для всего пакета auth
+identity_client = IdentityClient(
+    pool_size=int(os.getenv('IDENTITY_HTTP_POOL_SIZE', 20)),
+    max_retries=int(os.getenv('IDENTITY_HTTP_MAX_RETRIES', 2)),
+)
@@ -0,0 +1,84 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TokenRenewer:
+    """
+    Фоновое продление ID-токенов, которые скоро истекут.
+    Запрос обслуживается еще валидным токеном, обновление идет в пуле потоков,
+    а новая пара токенов отдается в куках одного из следующих ответов.
+    """
+
+    def __init__(self, refresh_fn, window=300, result_ttl=600, max_workers=2):
+        self.refresh_fn = refresh_fn
+        self.window = window  # За сколько секунд до exp начинаем продлевать токен
+        self.result_ttl = result_ttl
+        self.scheduled = 0
+        self.delivered = 0
+        self.failed = 0
+        self._pending = set()
+        self._ready = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='token-renewer')
+
+    @staticmethod
+    def _key(refresh_token):
+        return hashlib.sha256(refresh_token.encode('utf-8')).hexdigest()
+
+    def in_window(self, decoded_token):
+        expires_at = decoded_token.get('exp')
+        return bool(expires_at) and expires_at - time.time() <= self.window
+
+    def schedule(self, refresh_token):
+        key = self._key(refresh_token)
+        with self._lock:
+            if key in self._pending or key in self._ready:
+                return
+            self._pending.add(key)
+            self.scheduled += 1
+        self._executor.submit(self._renew, key, refresh_token)
+
+    def pop_ready(self, refresh_token):
+        key = self._key(refresh_token)
+        with self._lock:
+            entry = self._ready.pop(key, None)
+            if entry is None:
+                return None
+            expires_at, tokens = entry
+            if time.time() >= expires_at:
+                return None
+            self.delivered += 1
+            return tokens
+
+    def stats(self):
+        with self._lock:
+            return {
+                "scheduled": self.scheduled,
+                "delivered": self.delivered,
+                "failed": self.failed,
+                "pending": len(self._pending),
+                "ready": len(self._ready),
+            }
+
+    def _renew(self, key, refresh_token):
+        try:
+            new_id_token, new_refresh_token = self.refresh_fn(refresh_token)
+        except Exception as e:
+            print(f"Ошибка фонового продления токена: {e}")
+            new_id_token, new_refresh_token = None, None
+
+        with self._lock:
+            self._pending.discard(key)
+            if not new_id_token:
+                self.failed += 1
+                return
+            self._purge_expired()
+            self._ready[key] = (time.time() + self.result_ttl, (new_id_token, new_refresh_token))
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [key for key, (expires_at, _) in self._ready.items() if expires_at <= now]
+        for key in expired:
+            del self._ready[key]
@@ -1,8 +1,20 @@
 from flask import Blueprint, request, jsonify
-from .auth_controller import sign_in_with_google, check_user, sign_in_cookie, sign_in, sign_out, register, check_username, verify_token, confirm, send_email_password_reset, update_username, reset_password, resend_email_verify
+from .auth_controller import sign_in_with_google, check_user, sign_in_cookie, sign_in, sign_out, register, check_username, verify_token, confirm, send_email_password_reset, update_username, reset_password, resend_email_verify, get_stats
+
+from services.rate_limiter import rate_limit, RateLimitPolicy
+from auth.utils import authenticate_request
 
 auth_routes = Blueprint('auth', __name__)
 
+# Лимиты публичных endpoint: token bucket + скользящее окно, по IP и по email
+SIGNIN_IP_POLICY = RateLimitPolicy(rate=0.5, burst=10, window=600, window_limit=60)
+SIGNIN_EMAIL_POLICY = RateLimitPolicy(rate=0.1, burst=5, window=3600, window_limit=20)
+REGISTER_IP_POLICY = RateLimitPolicy(rate=0.05, burst=5, window=3600, window_limit=20)
+REGISTER_EMAIL_POLICY = RateLimitPolicy(rate=0.01, burst=3, window=3600, window_limit=5)
+CHECK_USERNAME_IP_POLICY = RateLimitPolicy(rate=5, burst=20, window=600, window_limit=600)
+PASSWORD_RESET_IP_POLICY = RateLimitPolicy(rate=0.05, burst=5, window=3600, window_limit=20)
+PASSWORD_RESET_EMAIL_POLICY = RateLimitPolicy(rate=0.01, burst=3, window=3600, window_limit=3)
+
 @auth_routes.route("/auth/google", methods=["POST"])
 def sign_in_with_google_route():
     return sign_in_with_google()
@@ -16,6 +28,7 @@ def check_user_route():
     return check_user()
 
 @auth_routes.route('/auth/signin', methods=['POST'])
+@rate_limit('signin', SIGNIN_IP_POLICY, SIGNIN_EMAIL_POLICY, identity_field='email')
 def sign_in_route():
     return sign_in(request.json)
 
@@ -24,6 +37,7 @@ def sign_out_route():
     return sign_out()
 
 @auth_routes.route('/auth/register', methods=['POST'])
+@rate_limit('register', REGISTER_IP_POLICY, REGISTER_EMAIL_POLICY, identity_field='email')
 def register_route():
     return register(request.json)
 
@@ -32,6 +46,7 @@ def confirm_route():
     return confirm()
 
 @auth_routes.route('/auth/send_email_password_reset', methods=['POST'])
+@rate_limit('password_reset', PASSWORD_RESET_IP_POLICY, PASSWORD_RESET_EMAIL_POLICY, identity_field='email')
 def send_email_password_reset_route():
     return send_email_password_reset()
 
@@ -44,6 +59,7 @@ def resend_email_verify_route():
     return resend_email_verify()
 
 @auth_routes.route('/auth/check_username', methods=['POST'])
+@rate_limit('check_username', CHECK_USERNAME_IP_POLICY)
 def check_username_route():
     return check_username(request.json)
 
@@ -53,4 +69,10 @@ def update_username_route():
 
 @auth_routes.route('/verify-token', methods=['POST'])
 def verify_token_route():
-    return verify_token(request.json)
\ No newline at end of file
+    return verify_token(request.json)
+
+# Счетчики процесса для операторов (только админы)
+@auth_routes.route('/auth/stats', methods=['GET'])
+@authenticate_request
+def get_stats_route():
+    return get_stats()
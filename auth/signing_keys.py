@@ -0,0 +1,173 @@
+import json
+import re
+import threading
+import time
+from firebase_admin import auth
+from google.auth import jwt
+from auth.identity_client import identity_client
+
+# Публичные ключи, которыми securetoken подписывает ID-токены Firebase
+ID_TOKEN_CERT_URI = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+ID_TOKEN_ISSUER_PREFIX = 'https://securetoken.google.com/'
+
+# Публичные ключи сессионных кук Firebase Admin
+SESSION_COOKIE_CERT_URI = 'https://www.googleapis.com/identitytoolkit/v3/relyingparty/publicKeys'
+SESSION_COOKIE_ISSUER_PREFIX = 'https://session.firebase.google.com/'
+
+
+class UnknownSigningKeyError(Exception):
+    """Токен подписан ключом (kid), которого нет в памяти."""
+
+
+class SigningKeyStore:
+    """
+    Хранит публичные ключи Firebase в памяти и обновляет их в фоне
+    по Cache-Control max-age, чтобы проверка токенов не ждала сеть.
+    """
+
+    def __init__(self, cert_url=ID_TOKEN_CERT_URI, issuer_prefix=ID_TOKEN_ISSUER_PREFIX,
+                 invalid_error=auth.InvalidIdTokenError, expired_error=auth.ExpiredIdTokenError,
+                 refresh_margin=300, retry_interval=30, timeout=5):
+        self.cert_url = cert_url
+        self.issuer_prefix = issuer_prefix
+        self.invalid_error = invalid_error
+        self.expired_error = expired_error
+        self.refresh_margin = refresh_margin  # Обновляем ключи за N секунд до истечения max-age
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self.source = None
+        self.refresh_count = 0
+        self.refresh_errors = 0
+        self._keys = {}
+        self._expires_at = 0
+        self._refreshed_at = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def is_ready(self):
+        return bool(self._keys)
+
+    def keys(self):
+        return self._keys
+
+    def load_from_file(self, path):
+        # Файл в том же формате, что отдает Google: {"kid": "-----BEGIN CERTIFICATE-----..."}
+        with open(path, 'r', encoding='utf-8') as f:
+            keys = json.load(f)
+        self._set_keys(keys, max_age=None, source=f"file:{path}")
+
+    def refresh(self):
+        response = identity_client.session.get(self.cert_url, timeout=self.timeout)
+        response.raise_for_status()
+        max_age = _parse_max_age(response.headers.get('Cache-Control', ''))
+        self._set_keys(response.json(), max_age=max_age, source=self.cert_url)
+        return max_age
+
+    def request_refresh(self):
+        # Будим фоновый поток, не блокируя текущий запрос.
+        # Не чаще раза в retry_interval, чтобы токены с чужим kid не устроили шторм запросов
+        if time.time() - self._refreshed_at >= self.retry_interval:
+            self._wakeup.set()
+
+    def start_refresher(self):
+        if self._thread and self._thread.is_alive():
+            return
+
+        # Первая загрузка при старте воркера, до первого запроса пользователя
+        try:
+            self.refresh()
+        except Exception as e:
+            self.refresh_errors += 1
+            print(f"Не удалось загрузить ключи подписи токенов: {e}")
+
+        self._thread = threading.Thread(target=self._run, name='signing-keys-refresher', daemon=True)
+        self._thread.start()
+
+    def verify(self, token, project_id):
+        keys = self._keys
+        if not keys:
+            raise UnknownSigningKeyError("Signing keys are not loaded")
+
+        try:
+            header = jwt.decode_header(token)
+            payload = jwt.decode(token, verify=False)
+        except ValueError as e:
+            raise self.invalid_error(str(e), cause=e)
+
+        if header.get('alg') != 'RS256':
+            raise self.invalid_error('Firebase token has incorrect algorithm')
+        if not header.get('kid'):
+            raise self.invalid_error('Firebase token has no "kid" claim')
+        if header['kid'] not in keys:
+            raise UnknownSigningKeyError(f"Unknown signing key: {header['kid']}")
+        if payload.get('aud') != project_id:
+            raise self.invalid_error('Firebase token has incorrect "aud" (audience) claim')
+        if payload.get('iss') != self.issuer_prefix + project_id:
+            raise self.invalid_error('Firebase token has incorrect "iss" (issuer) claim')
+        subject = payload.get('sub')
+        if not subject or not isinstance(subject, str) or len(subject) > 128:
+            raise self.invalid_error('Firebase token has invalid "sub" (subject) claim')
+
+        try:
+            claims = jwt.decode(token, certs=keys, audience=project_id)
+        except ValueError as e:
+            if 'Token expired' in str(e):
+                raise self.expired_error(str(e), cause=e)
+            raise self.invalid_error(str(e), cause=e)
+
+        claims['uid'] = claims['sub']
+        return claims
+
+    def stats(self):
+        return {
+            "source": self.source,
+            "keys": len(self._keys),
+            "expires_in": max(0, int(self._expires_at - time.time())) if self._expires_at else None,
+            "refresh_count": self.refresh_count,
+            "refresh_errors": self.refresh_errors,
+        }
+
+    def _set_keys(self, keys, max_age, source):
+        if not isinstance(keys, dict) or not keys:
+            raise ValueError("Signing keys must be a non-empty JSON object")
+        with self._lock:
+            self._keys = dict(keys)
+            self._expires_at = time.time() + max_age if max_age else 0
+            self.source = source
+            self.refresh_count += 1
+            self._refreshed_at = time.time()
+
+    def _next_refresh_delay(self):
+        if not self._expires_at:
+            return self.retry_interval if not self._keys else 3600
+        return max(self.retry_interval, self._expires_at - time.time() - self.refresh_margin)
+
+    def _run(self):
+        delay = self._next_refresh_delay()
+        while True:
+            self._wakeup.wait(timeout=delay)
+            self._wakeup.clear()
+            try:
+                self.refresh()
+                delay = self._next_refresh_delay()
+            except Exception as e:
+                self.refresh_errors += 1
+                print(f"Ошибка фонового обновления ключей подписи: {e}")
+                # Старые ключи остаются в памяти, повторим попытку позже
+                delay = self.retry_interval
+
+
+def _parse_max_age(cache_control):
+    match = re.search(r'max-age=(\d+)', cache_control or '')
+    return int(match.group(1)) if match else None
+
+
+# Общие хранилища ключей для всего процесса
+signing_keys = SigningKeyStore()
+session_cookie_keys = SigningKeyStore(
+    cert_url=SESSION_COOKIE_CERT_URI,
+    issuer_prefix=SESSION_COOKIE_ISSUER_PREFIX,
+    invalid_error=auth.InvalidSessionCookieError,
+    expired_error=auth.ExpiredSessionCookieError,
+)
@@ -0,0 +1,88 @@
+import hashlib
+import threading
+import time
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Схлопывает одновременные вызовы с одинаковым ключом в один:
+    первый поток выполняет функцию, остальные ждут и получают тот же результат.
+    Успешный результат запоминается на result_ttl секунд.
+    """
+
+    def __init__(self, result_ttl=30):
+        self.result_ttl = result_ttl
+        self.executed = 0
+        self.coalesced = 0
+        self.remembered_hits = 0
+        self._calls = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(secret):
+        # В памяти держим только хеш (ключом обычно служит refresh-токен)
+        return hashlib.sha256(secret.encode('utf-8')).hexdigest()
+
+    def do(self, key, fn):
+        now = time.time()
+
+        with self._lock:
+            remembered = self._results.get(key)
+            if remembered is not None:
+                expires_at, value = remembered
+                if now < expires_at:
+                    self.remembered_hits += 1
+                    return value
+                del self._results[key]
+
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fn()
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if call.error is None:
+                    self._purge_expired(now)
+                    self._results[key] = (time.time() + self.result_ttl, call.value)
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "remembered_hits": self.remembered_hits,
+                "in_flight": len(self._calls),
+                "remembered": len(self._results),
+            }
+
+    def _purge_expired(self, now):
+        expired = [key for key, (expires_at, _) in self._results.items() if expires_at <= now]
+        for key in expired:
+            del self._results[key]
@@ -0,0 +1,84 @@
+import hashlib
+import threading
+import time
+
+
+class TokenCache:
+    """
+    Процессный кеш декодированных claims ID-токенов.
+    Ключ - sha256 от токена (сам токен в памяти не храним),
+    запись живет до момента `exp` из токена.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token):
+        key = self._key(token)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, claims = entry
+                if now < expires_at:
+                    self.hits += 1
+                    # Отдаем копию, чтобы вызывающий код не испортил закешированные claims
+                    return dict(claims)
+                # Токен истек - выбрасываем запись
+                del self._entries[key]
+
+            self.misses += 1
+            return None
+
+    def set(self, token, claims):
+        expires_at = claims.get('exp')
+        if not expires_at or expires_at <= time.time():
+            return
+
+        key = self._key(token)
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                self._evict_expired()
+            if len(self._entries) >= self.max_size:
+                # Все записи еще живы - удаляем ту, что истекает раньше всех
+                oldest_key = min(self._entries, key=lambda k: self._entries[k][0])
+                del self._entries[oldest_key]
+            self._entries[key] = (expires_at, dict(claims))
+
+    def invalidate(self, token):
+        with self._lock:
+            self._entries.pop(self._key(token), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
+
+    def _evict_expired(self):
+        now = time.time()
+        expired = [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+
+
+# Общий кеш для всего процесса
+token_cache = TokenCache()
@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from services.bloom_filter import BloomFilter
+from auth.usernames import USERNAMES_COLLECTION, username_key
+
+
+class UsernameFilter:
+    """
+    Bloom-фильтр занятых username (в нижнем регистре) для быстрого ответа /auth/check_username.
+    Фильтр строится из первого снимка слушателя коллекции usernames, а дальше пополняется
+    его изменениями - имена, занятые в других воркерах, приходят без перечитывания коллекции.
+    Освобожденные имена из Bloom-фильтра не удалить, поэтому раз в rebuild_interval секунд
+    слушатель пересоздается и фильтр строится заново. Регистрация и смена имени
+    всегда проверяют имя в Firestore.
+    """
+
+    def __init__(self, capacity, error_rate, rebuild_interval=21600):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.rebuild_interval = rebuild_interval
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.warmed_at = None
+        self.definite_negatives = 0
+        self.possible_positives = 0
+        self._listener = None
+        self._lock = threading.Lock()
+        self._rebuild_thread = None
+
+    @property
+    def ready(self):
+        # Без живого слушателя фильтр не узнает о новых именах и считается устаревшим
+        listener = self._listener
+        return self.warmed_at is not None and listener is not None and listener.is_active
+
+    def add(self, username):
+        try:
+            key = username_key(username)
+        except ValueError:
+            return
+        with self._lock:
+            self.bloom.add(key)
+
+    def definitely_available(self, username):
+        # True - имени точно нет в фильтре; False - нужна авторитетная проверка в Firestore
+        if not self.ready:
+            return False
+        try:
+            key = username_key(username)
+        except ValueError:
+            return False
+
+        if key in self.bloom:
+            self.possible_positives += 1
+            return False
+        self.definite_negatives += 1
+        return True
+
+    def warm(self, db):
+        """
+        Подписывается на коллекцию usernames (ID документа - username в нижнем регистре).
+        Первый снимок строит новый фильтр и подменяет им текущий, после чего
+        предыдущий слушатель снимается; следующие снимки добавляют новые имена.
+        """
+        building = BloomFilter(self.capacity, self.error_rate)
+        previous = self._listener
+        state = {"initial": True}
+
+        def _on_snapshot(snapshots, changes, read_time):
+            if state["initial"]:
+                state["initial"] = False
+                for snapshot in snapshots:
+                    building.add(snapshot.id)
+                with self._lock:
+                    self.bloom = building
+                    self.warmed_at = time.time()
+                if previous is not None:
+                    previous.unsubscribe()
+                print(f"Фильтр username прогрет: {building.count} имен")
+                return
+
+            with self._lock:
+                for change in changes:
+                    if change.type.name == 'ADDED':
+                        building.add(change.document.id)
+
+        self._listener = db.collection(USERNAMES_COLLECTION).on_snapshot(_on_snapshot)
+
+    def warm_in_background(self, db):
+        def _run():
+            while True:
+                try:
+                    self.warm(db)
+                except Exception as e:
+                    # Пока слушателя нет, проверки идут в Firestore
+                    print(f"Ошибка прогрева фильтра username: {e}")
+                time.sleep(self.rebuild_interval)
+
+        self._rebuild_thread = threading.Thread(target=_run, name='username-filter-rebuild', daemon=True)
+        self._rebuild_thread.start()
+
+    def stats(self):
+        stats = self.bloom.stats()
+        stats.update({
+            "ready": self.ready,
+            "definite_negatives": self.definite_negatives,
+            "possible_positives": self.possible_positives,
+        })
+        return stats
+
+
+username_filter = UsernameFilter(
+    capacity=int(os.getenv('USERNAME_BLOOM_CAPACITY', 100000)),
+    error_rate=float(os.getenv('USERNAME_BLOOM_ERROR_RATE', 0.01)),
+    rebuild_interval=int(os.getenv('USERNAME_BLOOM_REBUILD_INTERVAL', 21600)),
+)
@@ -0,0 +1,89 @@
+from google.cloud import firestore
+
+# Индекс занятых имен: usernames/{username_lower} -> {"uid": ..., "username": ...}
+USERNAMES_COLLECTION = 'usernames'
+
+
+class UsernameTakenError(Exception):
+    """Имя пользователя уже занято другим uid."""
+
+
+def username_key(username):
+    # Тот же ключ, что и поле username_lower в users
+    key = username.lower()
+    # Такие строки не могут быть ID документа Firestore
+    if not key or '/' in key or key in ('.', '..') or (key.startswith('__') and key.endswith('__')):
+        raise ValueError(f"Invalid username: {username}")
+    return key
+
+
+def _claim_ref(db, username):
+    return db.collection(USERNAMES_COLLECTION).document(username_key(username))
+
+
+def is_username_available(db, username, user_id=None):
+    # Одно чтение документа вместо запроса по коллекции users
+    try:
+        claim = _claim_ref(db, username).get()
+    except ValueError:
+        return False
+    return not claim.exists or (user_id is not None and claim.get('uid') == user_id)
+
+
+def create_user_with_username(db, user_id, user_data):
+    # Создает users/{uid} и занимает имя в одной транзакции
+    claim_ref = _claim_ref(db, user_data['username'])
+    user_ref = db.collection('users').document(user_id)
+
+    @firestore.transactional
+    def _create(transaction):
+        claim = claim_ref.get(transaction=transaction)
+        if claim.exists and claim.get('uid') != user_id:
+            raise UsernameTakenError(user_data['username'])
+
+        transaction.set(claim_ref, {"uid": user_id, "username": user_data['username']})
+        transaction.set(user_ref, user_data)
+
+    _create(db.transaction())
+    return user_ref
+
+
+def rename_username(db, user_id, new_username):
+    """
+    Меняет username в одной транзакции: освобождает старое имя, занимает новое и обновляет users/{uid}.
+    Возвращает "not_found", "unchanged", "taken" или "renamed".
+    """
+    new_claim_ref = _claim_ref(db, new_username)
+    user_ref = db.collection('users').document(user_id)
+
+    @firestore.transactional
+    def _rename(transaction):
+        user_doc = user_ref.get(transaction=transaction)
+        if not user_doc.exists:
+            return "not_found"
+
+        user_data = user_doc.to_dict()
+        current_username = user_data.get('username')
+        if current_username == new_username:
+            return "unchanged"
+
+        # В транзакции все чтения должны идти до записей
+        new_claim = new_claim_ref.get(transaction=transaction)
+        old_claim_ref = None
+        old_claim = None
+        if current_username and username_key(current_username) != new_claim_ref.id:
+            old_claim_ref = _claim_ref(db, current_username)
+            old_claim = old_claim_ref.get(transaction=transaction)
+
+        if new_claim.exists and new_claim.get('uid') != user_id:
+            return "taken"
+
+        if old_claim is not None and old_claim.exists and old_claim.get('uid') == user_id:
+            transaction.delete(old_claim_ref)
+
+        transaction.set(new_claim_ref, {"uid": user_id, "username": new_username})
+        transaction.update(user_ref, {"username": new_username, "username_lower": new_claim_ref.id})
+        return "renamed"
+
+    return _rename(db.transaction())
+
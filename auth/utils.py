@@ -2,14 +2,22 @@ from functools import wraps
 from flask import request, jsonify, make_response, g
 import firebase_admin
 from firebase_admin import auth
-import os
-import requests
 from werkzeug.wrappers import Response
 import traceback
 from services.exception_handler import default_error_response, validation_error_response, firebase_error_response
+from auth.token_cache import token_cache, TokenCache
+from auth.signing_keys import signing_keys, session_cookie_keys, UnknownSigningKeyError
+from auth.single_flight import SingleFlight
+from auth.identity_client import identity_client
+from auth.renewal import TokenRenewer
+import os
+from datetime import timedelta
 
-# Получаем ключ API из переменных окружения
-FIREBASE_API_KEY = os.getenv('FIREBASE_API_KEY')
+# Сессионная кука Firebase Admin (режим AUTH_MODE=session)
+SESSION_COOKIE_NAME = 'session'
+
+# Кеш claims сессионных кук, так же до момента exp
+session_cookie_cache = TokenCache()
 
 def authenticate_request(f):
     @wraps(f)
@@ -17,18 +25,35 @@ def authenticate_request(f):
         print("\n--- Начало аутентификации ---")
         
         # Получаем токены из куки
+        session_cookie = request.cookies.get(SESSION_COOKIE_NAME)
         token = request.cookies.get('firebase_token')
         refresh_token = request.cookies.get('refresh_token')
-        print(f"Токены из куки - firebase_token: {'есть' if token else 'нет'}, refresh_token: {'есть' if refresh_token else 'нет'}")
+        print(f"Токены из куки - session: {'есть' if session_cookie else 'нет'}, firebase_token: {'есть' if token else 'нет'}, refresh_token: {'есть' if refresh_token else 'нет'}")
 
         # Обработка отсутствия токенов
-        if not token and not refresh_token:
+        if not session_cookie and not token and not refresh_token:
             print("Ошибка: Отсутствуют оба токена")
             return firebase_error_response("Authentication required", 401)
 
         try:
+            # Сессионная кука проверяется локально и не требует обновления через securetoken
+            if session_cookie:
+                decoded_session = _decode_session_cookie(session_cookie)
+                if decoded_session:
+                    auth_response = _verify_token(None, decoded_session)
+                    if isinstance(auth_response, Response):
+                        return auth_response
+                    return f(*args, **kwargs)
+
+                # Сессия истекла - пробуем старые куки, если они есть
+                if not token and not refresh_token:
+                    return firebase_error_response("Session expired", 401)
+
+            # Декодируем токен один раз (повторные запросы с той же кукой берутся из кеша)
+            decoded_token = _decode_token(token) if token else None
+
             # Если токен невалиден или отсутствует
-            if not token or not _is_token_valid(token):
+            if not decoded_token:
                 if not refresh_token:
                     return firebase_error_response("Could not refresh token", 401)
                 
@@ -44,15 +69,25 @@ def authenticate_request(f):
                 
                 # Создаем ответ с установкой куки
                 response = make_response(f(*args, **kwargs))
-                response.set_cookie('firebase_token', new_token, httponly=True, samesite='Lax', secure=False)
+                set_token_cookies(response, new_token)
                 return response
 
             # Основная проверка валидного токена
-            auth_response = _verify_token(token)
+            auth_response = _verify_token(token, decoded_token)
             if isinstance(auth_response, Response):
                 return auth_response
-            
-            return f(*args, **kwargs)
+
+            # Токен скоро истечет: отвечаем с текущим, а продлеваем его в фоне
+            renewed_tokens = token_renewer.pop_ready(refresh_token) if refresh_token else None
+            if renewed_tokens is None:
+                if refresh_token and token_renewer.in_window(decoded_token):
+                    token_renewer.schedule(refresh_token)
+                return f(*args, **kwargs)
+
+            # Продленные токены готовы - отдаем их в куках этого ответа
+            response = make_response(f(*args, **kwargs))
+            set_token_cookies(response, *renewed_tokens)
+            return response
 
         except Exception as e:
             print(f"Ошибка аутентификации: {str(e)}")
@@ -62,14 +97,104 @@ def authenticate_request(f):
 
     return decorated_function
 
-def _is_token_valid(token):
+def set_token_cookies(response, id_token, refresh_token=None):
+    response.set_cookie('firebase_token', id_token, httponly=True, samesite='Lax', secure=False)
+    if refresh_token:
+        response.set_cookie('refresh_token', refresh_token, httponly=True, samesite='Lax', secure=False)
+    return response
+
+def session_mode_enabled():
+    # Читаем при вызове: .env загружается уже после импорта модулей
+    return os.getenv('AUTH_MODE', 'id_token') == 'session'
+
+def set_session_cookie(response, id_token):
+    # В режиме session меняем ID-токен на сессионную куку; False - вызывающий ставит обычные куки
+    if not session_mode_enabled():
+        return False
+
     try:
-        auth.verify_id_token(token)
-        return True
-    except auth.ExpiredIdTokenError:
+        # Пока email не подтвержден, остаемся на паре firebase_token/refresh_token:
+        # они нужны confirm() и resend_email_verify(), а сессионная кука навсегда
+        # запомнила бы email_verified=false
+        if not verify_id_token_cached(id_token).get("email_verified", False):
+            return False
+
+        max_age = int(os.getenv('SESSION_COOKIE_MAX_AGE', 60 * 60 * 24 * 14))
+        session_cookie = auth.create_session_cookie(id_token, expires_in=timedelta(seconds=max_age))
+    except Exception as e:
+        print(f"Ошибка создания сессионной куки: {e}")
         return False
+
+    response.set_cookie(SESSION_COOKIE_NAME, session_cookie, max_age=max_age, httponly=True, samesite='Lax', secure=False)
+    # Старые куки больше не нужны
+    response.set_cookie('firebase_token', '', max_age=0, httponly=True, samesite='Lax', secure=False)
+    response.set_cookie('refresh_token', '', max_age=0, httponly=True, samesite='Lax', secure=False)
+    return True
+
+def verify_request_cookie():
+    # Проверка куки текущего запроса: сессионная кука, если есть, иначе firebase_token
+    session_cookie = request.cookies.get(SESSION_COOKIE_NAME)
+    if session_cookie:
+        return verify_session_cookie_cached(session_cookie)
+    return verify_id_token_cached(request.cookies.get('firebase_token'))
+
+def verify_session_cookie_cached(session_cookie):
+    if not session_cookie:
+        return auth.verify_session_cookie(session_cookie)
+
+    decoded_session = session_cookie_cache.get(session_cookie)
+    if decoded_session is not None:
+        return decoded_session
+
+    decoded_session = None
+    if session_cookie_keys.is_ready():
+        try:
+            decoded_session = session_cookie_keys.verify(session_cookie, firebase_admin.get_app().project_id)
+        except UnknownSigningKeyError:
+            session_cookie_keys.request_refresh()
+    if decoded_session is None:
+        decoded_session = auth.verify_session_cookie(session_cookie)
+
+    session_cookie_cache.set(session_cookie, decoded_session)
+    return decoded_session
+
+def _decode_session_cookie(session_cookie):
+    try:
+        return verify_session_cookie_cached(session_cookie)
     except Exception:
-        return False
+        return None
+
+def verify_id_token_cached(token):
+    # Проверка ID-токена с кешированием claims до момента exp
+    if not token:
+        # Пустой токен отдаем в SDK, чтобы получить его стандартную ошибку
+        return auth.verify_id_token(token)
+
+    decoded_token = token_cache.get(token)
+    if decoded_token is not None:
+        return decoded_token
+
+    decoded_token = _verify_signature(token)
+    token_cache.set(token, decoded_token)
+    return decoded_token
+
+def _verify_signature(token):
+    # Проверяем подпись ключами из памяти; SDK (с загрузкой сертификатов) - только запасной путь
+    if signing_keys.is_ready():
+        try:
+            return signing_keys.verify(token, firebase_admin.get_app().project_id)
+        except UnknownSigningKeyError:
+            # Ключи, видимо, сменились - просим фоновый поток обновить их
+            signing_keys.request_refresh()
+    return auth.verify_id_token(token)
+
+def _decode_token(token):
+    try:
+        return verify_id_token_cached(token)
+    except auth.ExpiredIdTokenError:
+        return None
+    except Exception:
+        return None
 
 def _handle_token_refresh(refresh_token):
     print("Попытка обновления токена...")
@@ -79,10 +204,11 @@ def _handle_token_refresh(refresh_token):
         return new_id_token, new_refresh_token
     return None, None
 
-def _verify_token(token):
+def _verify_token(token, decoded_token=None):
     try:
         print("Проверка токена...")
-        decoded_token = auth.verify_id_token(token)
+        if decoded_token is None:
+            decoded_token = verify_id_token_cached(token)
         
         email_verified = decoded_token.get("email_verified", False)
         print(f"Статус подтверждения email: {email_verified}")
@@ -101,32 +227,42 @@ def _verify_token(token):
 
 
 
+# Одновременные обновления по одному refresh-токену выполняются одним запросом к securetoken
+refresh_flight = SingleFlight(result_ttl=30)
+
 # Функция для обновления токенов
 def refresh_token_method(refresh_token):
     try:
-        # Запрос на обновление токена
-        response = requests.post(
-            f'https://securetoken.googleapis.com/v1/token?key={FIREBASE_API_KEY}',
-            data={
-                'grant_type': 'refresh_token',
-                'refresh_token': refresh_token
-            }
-        )
-        
-        # Проверяем, есть ли ошибка в ответе
-        response_data = response.json()
-        if 'error' in response_data:
-            raise Exception(response_data['error']['message'])  # Выбросить исключение вместо возврата ошибки
-        
-        # Возвращаем новый idToken и refreshToken
-        new_id_token = response_data.get("id_token")
-        new_refresh_token = response_data.get("refresh_token")
-        
-        if not new_id_token or not new_refresh_token:
-            raise Exception("Failed to get id_token or refresh_token")
-        
-        return new_id_token, new_refresh_token
-    
+        return refresh_flight.do(SingleFlight.key_for(refresh_token), lambda: _exchange_refresh_token(refresh_token))
+
     except Exception as e:
-        return default_error_response(str(e), 500)  # Обработать ошибку в вызывающем методе
+        # Ошибку не запоминаем: следующий запрос попробует обновить токен заново
+        print(f"Ошибка обновления токена: {str(e)}")
+        return None, None
+
+def _exchange_refresh_token(refresh_token):
+    # Запрос на обновление токена
+    response = identity_client.post(
+        'token',
+        data={
+            'grant_type': 'refresh_token',
+            'refresh_token': refresh_token
+        }
+    )
+
+    # Проверяем, есть ли ошибка в ответе
+    response_data = response.json()
+    if 'error' in response_data:
+        raise Exception(response_data['error']['message'])
+
+    # Возвращаем новый idToken и refreshToken
+    new_id_token = response_data.get("id_token")
+    new_refresh_token = response_data.get("refresh_token")
+
+    if not new_id_token or not new_refresh_token:
+        raise Exception("Failed to get id_token or refresh_token")
+
+    return new_id_token, new_refresh_token
 
+# Фоновое продление токенов в последние TOKEN_RENEWAL_WINDOW секунд до exp
+token_renewer = TokenRenewer(refresh_token_method, window=int(os.getenv('TOKEN_RENEWAL_WINDOW', 300)))
@@ -1,11 +1,22 @@
-from flask import jsonify, request, g
+from flask import jsonify, request, g, Response, stream_with_context
 from pydantic import ValidationError
 from models.event import EventCreate, EventUpdate
-from models.todo import Todo
+from models.todo import Todo, TodoOperation
 from services.exception_handler import default_error_response, validation_error_response
 from services.response_handler import default_response
 from datetime import datetime
-from services.validation import validate_user, validate_event, validate_permission, validate_guest_phone
+from google.cloud import firestore
+from services.validation import validate_user, validate_event, validate_permission, validate_event_permission, validate_guest_phone, invalidate_event_permissions, check_event_access, is_admin
+from services.user_context import get_user_doc
+from services.loader import get_loader, get_all_in_transaction
+from services.pagination import page_params, fetch_page, PageTokenError
+from services.event_stats import read_event_stats, stats_shard_refs, GUESTS_VERSION_FIELD
+from services.diff import changed_fields
+from services.todo_ops import apply_todo_operations, TodoOperationError
+from services.event_deletion import delete_event_cascade
+from services.background_jobs import background_jobs
+from services.change_feed import stream as change_feed_stream
+from services.etag import event_etag, etag_matches, not_modified_response, with_etag
 
 # Основная логика добавления события
 def add_event(data, db):
@@ -16,7 +27,8 @@ def add_event(data, db):
         if user_error:
             return user_error
 
-        user_doc = db.collection('users').document(user_id).get()
+        # Тот же документ, что уже прочитан в validate_user
+        user_doc = get_user_doc(user_id, db)
         user_data = user_doc.to_dict()
         data['userId'] = user_id
         allowed_users = [{
@@ -27,6 +39,8 @@ def add_event(data, db):
             "email_lower": user_data.get("email").lower(),
         }]
         data['allowedUsers'] = allowed_users
+        # Денормализованный список ID для запроса array_contains в get_events
+        data['allowedUserIds'] = [user_id]
         data['created'] = datetime.utcnow()
 
         event_data = EventCreate(**data)
@@ -40,8 +54,66 @@ def add_event(data, db):
     except Exception as e:
         return default_error_response(str(e), 500)
 
+def _parse_include(data, default=("guests",)):
+    """
+    Какие связанные данные разворачивать в ответе: include = ["guests"] или "guests".
+    Пустой список - отдать события как есть, с ID гостей вместо самих гостей.
+    """
+    include = data.get("include", list(default))
+    if isinstance(include, str):
+        include = [part.strip() for part in include.split(",") if part.strip()]
+    return set(include or [])
+
+class ProjectionError(ValueError):
+    """Некорректный параметр fields."""
+
+# Поля для view=summary: то, что показывает дашборд. guests читаем только ради guestCount
+SUMMARY_FIELDS = ["eventName", "eventDate", "eventTime", "eventLocation", "eventDesignId", "created", "guests"]
+
+def _parse_projection(data):
+    """
+    Проекция для select(): None - полный документ, иначе список полей.
+    view=summary дает SUMMARY_FIELDS, fields = ["eventName", ...] или "eventName,eventDate" - произвольный набор.
+    """
+    if data.get("view") == "summary":
+        return list(SUMMARY_FIELDS)
+
+    fields = data.get("fields")
+    if fields is None:
+        return None
+    if isinstance(fields, str):
+        fields = [part.strip() for part in fields.split(",") if part.strip()]
+    if not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+        raise ProjectionError("fields must be a list of strings")
+
+    unknown = [field for field in fields if field not in EventCreate.model_fields]
+    if not fields or unknown:
+        raise ProjectionError(f"Unknown fields: {', '.join(unknown)}" if unknown else "fields must not be empty")
+    return list(fields)
+
+def _project_event(event_data, data):
+    # Для summary вместо списка ID гостей отдаем только их число
+    if data.get("view") == "summary":
+        event_data["guestCount"] = len(event_data.pop("guests", []))
+    return event_data
+
+def _expand_guests(db, events):
+    # Гостей всех событий собираем и читаем вместе чанками get_all, без запроса на каждого гостя
+    loader = get_loader(db)
+    for event_data in events:
+        loader.prefetch("guests", event_data.get("guests", []))
+
+    for event_data in events:
+        guests = []
+        for guest_doc in loader.load_many("guests", event_data.get("guests", [])):
+            if guest_doc.exists:
+                guest_data = guest_doc.to_dict()
+                guest_data["id"] = guest_doc.id
+                guests.append(guest_data)
+        event_data["guests"] = guests
+
 # Основная логика получения событий
-def get_events(db):
+def get_events(data, db):
     try:
         user_id = g.user.get("uid")
         # Валидация пользователя
@@ -49,31 +121,46 @@ def get_events(db):
         if user_error:
             return user_error
 
-        events_ref = db.collection('events')
-        docs = events_ref.stream()
+        # Читаем только события пользователя, а не всю коллекцию
+        events_query = db.collection('events').where('allowedUserIds', 'array_contains', user_id)
+
+        # Проекция: Firestore отдает только нужные поля (created нужен для курсора страниц)
+        fields = _parse_projection(data)
+        if fields:
+            events_query = events_query.select(sorted(set(fields) | {"created"}))
+
+        # Постраничная выдача, только если клиент передал limit или pageToken
+        paging = page_params(data)
+        if paging:
+            limit, page_token = paging
+            docs, next_page_token = fetch_page(events_query, f"events:{user_id}", ["created"], limit, page_token)
+        else:
+            docs = events_query.stream()
 
         events = []
         for doc in docs:
             event_data = doc.to_dict()
             event_data["id"] = doc.id
-            allowed_users = event_data.get("allowedUsers", [])
-            if any(user.get("id") == user_id for user in allowed_users):
-                guest_ids = event_data.get("guests", [])
-                guests = []
-                for guest_id in guest_ids:
-                    guest_doc = db.collection("guests").document(guest_id).get()
-                    if guest_doc.exists:
-                        guest_data = guest_doc.to_dict()
-                        guest_data["id"] = guest_doc.id
-                        guests.append(guest_data)
-                event_data["guests"] = guests
-                events.append(event_data)
+            if fields:
+                event_data = {key: value for key, value in event_data.items() if key in fields or key == "id"}
+            events.append(event_data)
+
+        if data.get("view") == "summary":
+            events = [_project_event(event_data, data) for event_data in events]
+        elif "guests" in _parse_include(data) and (not fields or "guests" in fields):
+            _expand_guests(db, events)
+
+        if paging:
+            return jsonify({"items": events, "nextPageToken": next_page_token}), 200
 
         if events:
             return jsonify(events), 200
         else:
             return default_error_response("No events found for the user", 404)
 
+    except (PageTokenError, ProjectionError) as e:
+        return validation_error_response(str(e), 400)
+
     except Exception as e:
         return default_error_response(str(e), 500)
 
@@ -89,10 +176,31 @@ def get_event_by_id(data, db):
 
 
         event_id = data.get("eventId")
-        # Валидация события
-        event_doc = validate_event(event_id, db)  # Теперь возвращаем сам документ события
-        if isinstance(event_doc, dict):  # Если возвращен словарь с ошибкой
-            return event_doc  # Возвращаем ошибку, если событие не найдено
+        fields = _parse_projection(data)
+        variant = {key: data.get(key) for key in ("view", "fields", "include")}
+
+        # Условный запрос: один get_all события (только allowedUsers) и шардов его счетчиков вместо события, гостей и JSON
+        if request.if_none_match and event_id:
+            event_ref = db.collection('events').document(event_id)
+            probe = {doc.reference.path: doc for doc in db.get_all([event_ref] + stats_shard_refs(db, event_id), field_paths=["allowedUsers"])}
+            probe_doc = probe.pop(event_ref.path)
+            if probe_doc.exists and validate_permission(user_id, probe_doc, db) is None:
+                etag = event_etag(probe_doc, probe.values(), variant)
+                if etag_matches(etag):
+                    return not_modified_response(etag)
+
+        if fields:
+            # Читаем только нужные поля; allowedUsers нужен для проверки прав
+            if not event_id:
+                return default_error_response("Event ID is required", 400)
+            event_doc = db.collection('events').document(event_id).get(field_paths=sorted(set(fields) | {"allowedUsers"}))
+            if not event_doc.exists:
+                return default_error_response("Event not found", 404)
+        else:
+            # Валидация события
+            event_doc = validate_event(event_id, db)  # Теперь возвращаем сам документ события
+            if isinstance(event_doc, dict):  # Если возвращен словарь с ошибкой
+                return event_doc  # Возвращаем ошибку, если событие не найдено
 
         event_data = event_doc.to_dict()  # Преобразуем документ в словарь
         event_data["id"] = event_doc.id
@@ -102,55 +210,50 @@ def get_event_by_id(data, db):
         if permission_error:
             return permission_error
 
-        guest_ids = event_data.get("guests", [])
-        guests = []
+        # Время записи одного из шардов счетчиков меняется с каждой записью гостя
+        stats_shards = list(db.get_all(stats_shard_refs(db, event_id), field_paths=[GUESTS_VERSION_FIELD]))
+        etag = event_etag(event_doc, stats_shards, variant)
 
-        for guest_id in guest_ids:
-            guest_doc = db.collection("guests").document(guest_id).get()
-            if guest_doc.exists:
-                guest_data = guest_doc.to_dict()  # Преобразуем гостя в словарь
-                guest_data["id"] = guest_doc.id
-                guests.append(guest_data)
+        if fields:
+            event_data = {key: value for key, value in event_data.items() if key in fields or key == "id"}
 
-        event_data["guests"] = sorted(guests, key=lambda g: g.get("created", ""), reverse=True)
+        if data.get("view") == "summary":
+            event_data = _project_event(event_data, data)
+        elif "guests" in _parse_include(data) and (not fields or "guests" in fields):
+            _expand_guests(db, [event_data])
+            event_data["guests"] = sorted(event_data["guests"], key=lambda g: g.get("created", ""), reverse=True)
 
-        return jsonify(event_data), 200  # Возвращаем правильный JSON ответ
+        return with_etag(jsonify(event_data), etag), 200  # Возвращаем правильный JSON ответ
+
+    except ProjectionError as e:
+        return validation_error_response(str(e), 400)
 
     except Exception as e:
         return default_error_response(str(e), 500)
 
 
+def _delete_event_job(db, event_id, progress=None):
+    deleted_guests = delete_event_cascade(db, event_id, progress)
+    invalidate_event_permissions(event_id)
+    return {"eventId": event_id, "deletedGuests": deleted_guests}
+
 # Логика удаления события
 def delete_event(data, db):
     try:
         user_id = g.user.get("uid")
-        # Валидация пользователя
-        user_error = validate_user(user_id, db)
-        if user_error:
-            return user_error
-
-        # Валидация события
-        event_doc = validate_event(event_id, db)  # Теперь возвращаем сам документ события
-        if isinstance(event_doc, dict):  # Если возвращен словарь с ошибкой
-            return event_doc  # Возвращаем ошибку, если событие не найдено
-
-        event_data = event_doc.to_dict()  # Преобразуем документ в словарь
+        event_id = data.get("eventId")
 
-        # Валидация прав доступа
-        permission_error = validate_permission(user_id, event_doc, db)
+        # Валидация пользователя, события и прав доступа
+        permission_error = validate_event_permission(user_id, event_id, db)
         if permission_error:
             return permission_error
 
-        guests_ref = db.collection('guests')
-        guests_query = guests_ref.where("eventId", "==", data['eventId'])
-        guests_docs = guests_query.stream()
-
-        for guest in guests_docs:
-            guest_ref = guests_ref.document(guest.id)
-            guest_ref.delete()
+        # Для больших событий: удаление в фоне, клиент следит за статусом по jobId
+        if data.get("async"):
+            job_id = background_jobs.submit("delete_event", user_id, _delete_event_job, db, event_id)
+            return default_response({"message": "Event deletion started", "jobId": job_id}, 202)
 
-        event_ref = db.collection('events').document(data['eventId'])
-        event_ref.delete()
+        _delete_event_job(db, event_id)
 
         return default_response("Event deleted successfully", 200)
 
@@ -158,36 +261,67 @@ def delete_event(data, db):
         return default_error_response(str(e), 500)
 
 
+# Статус фонового удаления события
+def get_delete_event_status(data, db):
+    try:
+        user_id = g.user.get("uid")
+        job_id = data.get("jobId")
+        if not job_id:
+            return validation_error_response("Job ID is required", 400)
+
+        job = background_jobs.get(job_id)
+        # Чужие задачи не показываем, как и несуществующие
+        if not job or job["owner"] != user_id:
+            return default_error_response("Job not found", 404)
+
+        job.pop("owner")
+        return default_response(job, 200)
+
+    except Exception as e:
+        return default_error_response(str(e), 500)
+
+
 # Логика обновления события
 def update_event(data, db):
     try:
         user_id = g.user.get("uid")
-        # Валидация пользователя
-        user_error = validate_user(user_id, db)
-        if user_error:
-            return user_error
+        if not user_id:
+            return default_error_response("User ID not found", 400)
 
         event_id = data.get("eventId")
+        if not event_id:
+            return default_error_response("Event ID is required", 400)
 
-        # Валидация события
-        event_doc = validate_event(event_id, db)  # Теперь возвращаем сам документ события
-        if isinstance(event_doc, dict):  # Если возвращен словарь с ошибкой
-            return event_doc  # Возвращаем ошибку, если событие не найдено
+        data['updated'] = datetime.utcnow()
+        event_data = EventUpdate(**data)
+        update = event_data.dict(exclude_unset=True)
+        updated_at = update.pop('updated', None)
 
-        event_data = event_doc.to_dict()  # Преобразуем документ в словарь
+        user_ref = db.collection('users').document(user_id)
+        event_doc_ref = db.collection('events').document(event_id)
 
-        # Валидация прав доступа
-        permission_error = validate_permission(user_id, event_doc, db)
-        if permission_error:
-            return permission_error
+        # Пользователь и событие читаются одним get_all, проверка прав и запись - в той же транзакции
+        @firestore.transactional
+        def _update(transaction):
+            user_doc, event_doc = get_all_in_transaction(transaction, [user_ref, event_doc_ref])
+            permission_error = check_event_access(user_id, user_doc, event_doc)
+            if permission_error:
+                return permission_error, []
 
-        data['updated'] = datetime.utcnow()
-        event_data = EventUpdate(**data)
+            # Пишем только реально изменившиеся поля; если изменений нет - записи нет совсем
+            changes = changed_fields(event_doc.to_dict(), update)
+            if changes:
+                transaction.update(event_doc_ref, {**changes, 'updated': updated_at})
+            return None, sorted(changes)
+
+        error, updated_fields = _update(db.transaction())
+        if error:
+            return error
 
-        event_doc_ref = db.collection('events').document(data['eventId'])
-        event_doc_ref.update(event_data.dict(exclude_unset=True))
+        if not updated_fields:
+            return default_response({"message": "Event is up to date", "updatedFields": []}, 200)
 
-        return default_response({"message": "Event updated successfully"}, 200)
+        return default_response({"message": "Event updated successfully", "updatedFields": updated_fields}, 200)
 
     except ValidationError as e:
         return validation_error_response(str(e.errors()), 400)
@@ -197,6 +331,46 @@ def update_event(data, db):
 
 
 
+# Счетчики гостей события (по статусу, тегу и напиткам) без чтения самих гостей
+def get_event_stats(data, db):
+    try:
+        user_id = g.user.get("uid")
+        event_id = data.get("eventId")
+
+        # Валидация пользователя, события и прав (событие читается только без решения в кеше)
+        permission_error = validate_event_permission(user_id, event_id, db)
+        if permission_error:
+            return permission_error
+
+        stats = read_event_stats(db, event_id)
+        stats["eventId"] = event_id
+
+        return jsonify(stats), 200
+
+    except Exception as e:
+        return default_error_response(str(e), 500)
+
+
+# Поток изменений события и его гостей (Server-Sent Events)
+def get_event_feed(event_id, db):
+    try:
+        user_id = g.user.get("uid")
+
+        # Валидация пользователя, события и прав доступа
+        permission_error = validate_event_permission(user_id, event_id, db)
+        if permission_error:
+            return permission_error
+
+        feed = change_feed_stream(db, event_id, user_id, is_admin(user_id, db))
+        response = Response(stream_with_context(feed), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'  # nginx не должен буферизовать поток
+        return response
+
+    except Exception as e:
+        return default_error_response(str(e), 500)
+
+
 # Логика получения дизайнов
 def get_event_designs(db):
     try:
@@ -217,24 +391,35 @@ def get_event_designs(db):
 def update_todo(data, db):
     try:
         user_id = g.user.get("uid")
+        if not user_id:
+            return default_error_response("User ID not found", 400)
 
-        # Валидация события
-        event_doc = db.collection('events').document(data['eventId']).get()
-        if not event_doc.exists:
-            return default_error_response("Event not found", 404)
-
-        # Валидация прав доступа
-        permission_error = validate_permission(user_id, event_doc, db)
-        if permission_error:
-            return permission_error
+        event_id = data.get("eventId")
+        if not event_id:
+            return default_error_response("Event ID is required", 400)
 
         # Валидация входящего списка todo с Pydantic
         todo_list = [Todo(**todo).dict() for todo in data['todoList']]
 
-        # Обновление списка todo в событии
-        db.collection('events').document(data['eventId']).update({
-            'todoList': todo_list
-        })
+        user_ref = db.collection('users').document(user_id)
+        event_ref = db.collection('events').document(event_id)
+
+        # Проверка прав и обновление списка todo в одной транзакции
+        @firestore.transactional
+        def _update(transaction):
+            user_doc, event_doc = get_all_in_transaction(transaction, [user_ref, event_ref])
+            permission_error = check_event_access(user_id, user_doc, event_doc)
+            if permission_error:
+                return permission_error
+
+            transaction.update(event_ref, {
+                'todoList': todo_list
+            })
+            return None
+
+        error = _update(db.transaction())
+        if error:
+            return error
 
         return default_response({"message": "Todo list updated successfully", "todoList": todo_list}, 200)
 
@@ -245,6 +430,61 @@ def update_todo(data, db):
         return default_error_response(str(e), 500)
 
 
+# Точечные операции над todoList: add, toggle, rename, remove, move.
+# Одна операция - поля в корне запроса, несколько - массив ops; все применяются атомарно
+def update_todo_items(data, db):
+    try:
+        user_id = g.user.get("uid")
+        if not user_id:
+            return default_error_response("User ID not found", 400)
+
+        event_id = data.get("eventId")
+        if not event_id:
+            return default_error_response("Event ID is required", 400)
+
+        raw_ops = data.get("ops")
+        if raw_ops is None:
+            raw_ops = [{key: value for key, value in data.items() if key != "eventId"}]
+        if not isinstance(raw_ops, list) or not raw_ops:
+            return validation_error_response("ops must be a non-empty list", 400)
+
+        # Валидация операций с Pydantic до любых чтений
+        operations = [TodoOperation(**op) for op in raw_ops]
+
+        user_ref = db.collection('users').document(user_id)
+        event_ref = db.collection('events').document(event_id)
+
+        # Чтение актуального списка, применение операций и запись - в одной транзакции,
+        # поэтому одновременные правки соавторов не затирают друг друга
+        @firestore.transactional
+        def _apply(transaction):
+            user_doc, event_doc = get_all_in_transaction(transaction, [user_ref, event_ref])
+            permission_error = check_event_access(user_id, user_doc, event_doc)
+            if permission_error:
+                return permission_error, None
+
+            todo_list = event_doc.to_dict().get('todoList', [])
+            new_todo_list = apply_todo_operations(todo_list, operations)
+            if new_todo_list != todo_list:
+                transaction.update(event_ref, {'todoList': new_todo_list})
+            return None, new_todo_list
+
+        error, todo_list = _apply(db.transaction())
+        if error:
+            return error
+
+        return default_response({"message": "Todo list updated successfully", "todoList": todo_list}, 200)
+
+    except ValidationError as e:
+        return validation_error_response(str(e.errors()), 400)
+
+    except TodoOperationError as e:
+        return validation_error_response(str(e), 400)
+
+    except Exception as e:
+        return default_error_response(str(e), 500)
+
+
 # Добавление нового юзера в allowedUsers
 def add_allowed_user(data, db):
     try:
@@ -296,6 +536,7 @@ def add_allowed_user(data, db):
         # Обновляем только поле allowedUsers
         event_doc.reference.update({
             "allowedUsers": current_allowed_users,
+            "allowedUserIds": [user.get("id") for user in current_allowed_users],
             "updated": datetime.utcnow()
         })
 
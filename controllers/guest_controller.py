@@ -9,7 +9,18 @@ from firebase_admin import credentials, auth
 from datetime import datetime
 from google.cloud.firestore import ArrayUnion
 from google.cloud import firestore
-from services.validation import validate_user, validate_event, validate_permission, validate_guest_phone
+from services.loader import get_loader, get_all_in_transaction
+from services.pagination import page_params, fetch_page, PageTokenError
+from services.event_stats import stats_delta, apply_stats_delta
+from services.diff import changed_fields
+from collections import Counter
+from services.validation import validate_user, validate_event, validate_permission, validate_event_permission, validate_guest_phone, check_event_access
+
+# Лимит Firestore - 500 операций на batch или транзакцию
+BATCH_LIMIT = 500
+# Гостей в одной транзакции update_guest_list: на каждого гостя - запись гостя и,
+# в худшем случае (все из разных событий), запись шарда счетчиков
+GUESTS_PER_TRANSACTION = BATCH_LIMIT // 2
 
 def add_guest_auth(data, db):
     try:
@@ -38,29 +49,27 @@ def add_guest_auth(data, db):
             return permission_error
 
         event_data = event_doc.to_dict()
-        existing_guests = event_data.get('guests', [])
 
-        for guest_id in existing_guests:
-            guest_ref = db.collection('guests').document(guest_id)
-            guest_doc = guest_ref.get()
-
-            if guest_doc.exists:
-                guest_data = guest_doc.to_dict()
-                if guest_data.get('guestPhone') == data['guestPhone']:
-                    return default_error_response("Guest with this phone number already exists in the event", 400)
+        # Проверка телефона: все гости события читаются одним get_all
+        phone_error = validate_guest_phone(event_data, data['guestPhone'], db)
+        if phone_error:
+            return phone_error
 
         # Валидация данных с использованием модели Pydantic
         guest_data = GuestCreate(**data)
 
-        # Добавление документа в коллекцию "guests"
-        guests_ref = db.collection('guests')
-        guest_doc_ref = guests_ref.add(guest_data.dict())  # Firestore генерирует id
-        guest_id = guest_doc_ref[1].id  # Получение сгенерированного id
+        # Гость, его id в событии и счетчики события пишутся одной batch
+        guest_doc_ref = db.collection('guests').document()  # Firestore генерирует id
+        guest_id = guest_doc_ref.id
+        new_guest = guest_data.dict()
+
+        batch = db.batch()
+        batch.set(guest_doc_ref, new_guest)
 
         # Добавляем только id гостя в массив гостей события
-        db.collection('events').document(data['eventId']).update({
-            'guests': ArrayUnion([guest_id])
-        })
+        batch.update(db.collection('events').document(data['eventId']), {'guests': ArrayUnion([guest_id])})
+        apply_stats_delta(batch, db, data['eventId'], stats_delta(new_guest=new_guest))
+        batch.commit()
 
         return default_response({"message": "Guest added successfully", "guestId": guest_id}, 200)
 
@@ -84,29 +93,27 @@ def add_guest(data, db):
             return event_doc  # Возвращаем ошибку, если событие не найдено
 
         event_data = event_doc.to_dict()  # Преобразуем документ в словарь
-        existing_guests = event_data.get('guests', [])
 
-        for guest_id in existing_guests:
-            guest_ref = db.collection('guests').document(guest_id)
-            guest_doc = guest_ref.get()
-
-            if guest_doc.exists:
-                guest_data = guest_doc.to_dict()
-                if guest_data.get('guestPhone') == data['guestPhone']:
-                    return default_error_response("Guest with this phone number already exists in the event", 400)
+        # Проверка телефона: все гости события читаются одним get_all
+        phone_error = validate_guest_phone(event_data, data['guestPhone'], db)
+        if phone_error:
+            return phone_error
 
         # Валидация данных с использованием модели Pydantic
         guest_data = GuestCreate(**data)
 
-        # Добавление документа в коллекцию "guests"
-        guests_ref = db.collection('guests')
-        guest_doc_ref = guests_ref.add(guest_data.dict())  # Firestore генерирует id
-        guest_id = guest_doc_ref[1].id  # Получение сгенерированного id
+        # Гость, его id в событии и счетчики события пишутся одной batch
+        guest_doc_ref = db.collection('guests').document()  # Firestore генерирует id
+        guest_id = guest_doc_ref.id
+        new_guest = guest_data.dict()
+
+        batch = db.batch()
+        batch.set(guest_doc_ref, new_guest)
 
         # Добавляем только id гостя в массив гостей события
-        db.collection('events').document(data['eventId']).update({
-            'guests': ArrayUnion([guest_id])
-        })
+        batch.update(db.collection('events').document(data['eventId']), {'guests': ArrayUnion([guest_id])})
+        apply_stats_delta(batch, db, data['eventId'], stats_delta(new_guest=new_guest))
+        batch.commit()
 
         return default_response({"message": "Guest added successfully", "guestId": guest_id}, 200)
 
@@ -126,59 +133,72 @@ def update_guest(data, db):
         if not user_id:
             return default_error_response("User ID not found", 400)
 
-        # Валидация пользователя
-        user_error = validate_user(user_id, db)
-        if user_error:
-            return user_error
-
         guest_id = data.get("guestId")
         if not guest_id:
             return default_error_response("Guest ID is required", 400)
 
-        # Проверка существования гостя
-        guest_doc_ref = db.collection('guests').document(guest_id)
-        guest_doc = guest_doc_ref.get()
-        if not guest_doc.exists:
-            return default_error_response("Guest not found", 404)
+        # Удаляем guestId из данных, чтобы не обновлять это поле.
+        # eventId необязателен: если клиент его передал, событие читается вместе с гостем
+        data.pop("guestId", None)
+        event_id_hint = data.pop("eventId", None)
 
-        guest_data = guest_doc.to_dict()
-        event_id = guest_data.get("eventId")
+        # Добавляем обновленное время
+        data['updated'] = datetime.utcnow()
 
-        if not event_id:
-            return default_error_response("Guest is not associated with any event", 400)
+        # Валидация данных с использованием модели Pydantic (до любых чтений)
+        guest_update_data = GuestUpdate(**data)
+        update = guest_update_data.dict(exclude_unset=True)
+        updated_at = update.pop('updated', None)
+
+        user_ref = db.collection('users').document(user_id)
+        guest_ref = db.collection('guests').document(guest_id)
+
+        # Чтение пользователя, гостя и события, проверка прав и запись - в одной транзакции
+        @firestore.transactional
+        def _update(transaction):
+            refs = [user_ref, guest_ref]
+            if event_id_hint:
+                refs.append(db.collection('events').document(event_id_hint))
+            snapshots = get_all_in_transaction(transaction, refs)
+            user_doc, guest_doc = snapshots[0], snapshots[1]
+
+            if not user_doc.exists:
+                return default_error_response("User not found in Firestore", 404), []
+            if not guest_doc.exists:
+                return default_error_response("Guest not found", 404), []
 
+            event_id = guest_doc.to_dict().get("eventId")
+            if not event_id:
+                return default_error_response("Guest is not associated with any event", 400), []
 
-        # Валидация события
-        event_doc = validate_event(event_id, db)  # Теперь возвращаем сам документ события
-        if isinstance(event_doc, dict):  # Если возвращен словарь с ошибкой
-            return event_doc  # Возвращаем ошибку, если событие не найдено
+            if event_id_hint == event_id:
+                event_doc = snapshots[2]
+            else:
+                event_doc = db.collection('events').document(event_id).get(transaction=transaction)
 
-        event_data = event_doc.to_dict()  # Преобразуем документ в словарь
+            permission_error = check_event_access(user_id, user_doc, event_doc)
+            if permission_error:
+                return permission_error, []
 
-        # Валидация события
-        # event_doc_ref = db.collection('events').document(event_id)
-        # event_doc = event_doc_ref.get()
-        # if not event_doc.exists:
-        #     return default_error_response("Associated event not found", 404)
+            # Пишем только изменившиеся поля; без изменений не трогаем ни гостя, ни событие, ни счетчики
+            old_guest = guest_doc.to_dict()
+            changes = changed_fields(old_guest, update)
+            if not changes:
+                return None, []
 
-        # Валидация разрешений пользователя для события
-        permission_error = validate_permission(user_id, event_doc, db)
-        if permission_error:
-            return permission_error
+            # Обновляем документ в коллекции "guests"; счетчики события отмечают изменение гостей (для ETag)
+            transaction.update(guest_ref, {**changes, 'updated': updated_at})
+            apply_stats_delta(transaction, db, event_id, stats_delta(old_guest, {**old_guest, **update}))
+            return None, sorted(changes)
 
-        # Удаляем guestId из данных, чтобы не обновлять это поле
-        data.pop("guestId", None)
+        error, updated_fields = _update(db.transaction())
+        if error:
+            return error
 
-        # Добавляем обновленное время
-        data['updated'] = datetime.utcnow()
+        if not updated_fields:
+            return default_response({"message": "Guest is up to date", "updatedFields": []}, 200)
 
-        # Валидация данных с использованием модели Pydantic
-        guest_update_data = GuestUpdate(**data)
-
-        # Обновляем документ в коллекции "guests"
-        guest_doc_ref.update(guest_update_data.dict(exclude_unset=True))
-
-        return default_response({"message": "Guest updated successfully"}, 200)
+        return default_response({"message": "Guest updated successfully", "updatedFields": updated_fields}, 200)
 
     except ValidationError as e:
         return validation_error_response(str(e.errors()), 400)
@@ -201,13 +221,21 @@ def update_guest_list(data, db):
             return user_error
 
         updated_guests = []
+        unchanged_guests = []
+        seen_guests = set()
         errors = []
+        # Проверенные обновления: (ссылка на гостя, eventId, изменения, updated)
+        pending = []
 
         # Проверяем, что в data есть ключ 'guests', который является списком
         guests = data.get("guests")
         if not isinstance(guests, list):
             return default_error_response("Guests must be a list", 400)
 
+        # Все гости из списка читаются одним get_all
+        loader = get_loader(db)
+        loader.prefetch('guests', [guest_data.get("id") for guest_data in guests if isinstance(guest_data, dict) and guest_data.get("id")])
+
         # Обрабатываем каждый объект гостя в массиве
         for guest_data in guests:
             guest_id = guest_data.get("id")
@@ -215,12 +243,18 @@ def update_guest_list(data, db):
                 errors.append(f"Guest ID is required for guest: {guest_data}")
                 continue
 
+            # Второе обновление того же гостя считалось бы от того же снимка и задвоило бы счетчики
+            if guest_id in seen_guests:
+                errors.append(f"Duplicate guest ID {guest_id}.")
+                continue
+            seen_guests.add(guest_id)
+
             # Проверка существования гостя
-            guest_doc_ref = db.collection('guests').document(guest_id)
-            guest_doc = guest_doc_ref.get()
+            guest_doc = loader.load('guests', guest_id)
             if not guest_doc.exists:
                 errors.append(f"Guest with ID {guest_id} not found.")
                 continue
+            guest_doc_ref = guest_doc.reference
 
             guest_data_from_db = guest_doc.to_dict()
             event_id = guest_data_from_db.get("eventId")
@@ -229,18 +263,13 @@ def update_guest_list(data, db):
                 errors.append(f"Guest {guest_id} is not associated with any event.")
                 continue
 
-            # Валидация события
-            event_doc = validate_event(event_id, db)
-            if isinstance(event_doc, dict):  # Если событие не найдено
-                errors.append(f"Event for guest {guest_id} not found.")
-                continue
-
-            event_data = event_doc.to_dict()
-
-            # Валидация разрешений пользователя для события
-            permission_error = validate_permission(user_id, event_doc, db)
+            # Валидация события и разрешений пользователя (решение кешируется на событие)
+            permission_error = validate_event_permission(user_id, event_id, db)
             if permission_error:
-                errors.append(f"Permission error for guest {guest_id}.")
+                if permission_error[1] == 404:
+                    errors.append(f"Event for guest {guest_id} not found.")
+                else:
+                    errors.append(f"Permission error for guest {guest_id}.")
                 continue
 
             # Удаляем guestId из данных, чтобы не обновлять это поле
@@ -256,9 +285,44 @@ def update_guest_list(data, db):
                 errors.append(f"Validation error for guest {guest_id}: {str(e.errors())}")
                 continue
 
-            # Обновляем документ в коллекции "guests"
-            guest_doc_ref.update(guest_update_data.dict(exclude_unset=True))
-            updated_guests.append(guest_id)
+            update = guest_update_data.dict(exclude_unset=True)
+            updated_at = update.pop('updated', None)
+            pending.append((guest_doc_ref, event_id, update, updated_at))
+
+        # Изменения и вклад в счетчики считаются по гостям, прочитанным в той же транзакции,
+        # что и запись: параллельный update_guest приведет к повтору, а не к расхождению счетчиков
+        @firestore.transactional
+        def _update_chunk(transaction, chunk):
+            guest_docs = get_all_in_transaction(transaction, [guest_ref for guest_ref, _, _, _ in chunk])
+            chunk_updated, chunk_unchanged, chunk_errors = [], [], []
+            event_deltas = {}
+
+            for guest_doc, (guest_ref, event_id, update, updated_at) in zip(guest_docs, chunk):
+                old_guest = guest_doc.to_dict() if guest_doc.exists else None
+                # Гость мог быть удален или перенесен после проверки прав
+                if not old_guest or old_guest.get("eventId") != event_id:
+                    chunk_errors.append(f"Guest with ID {guest_ref.id} not found.")
+                    continue
+
+                # Гостей без изменений не пишем
+                changes = changed_fields(old_guest, update)
+                if not changes:
+                    chunk_unchanged.append(guest_ref.id)
+                    continue
+
+                transaction.update(guest_ref, {**changes, 'updated': updated_at})
+                event_deltas.setdefault(event_id, Counter()).update(stats_delta(old_guest, {**old_guest, **update}))
+                chunk_updated.append(guest_ref.id)
+
+            for event_id, delta in event_deltas.items():
+                apply_stats_delta(transaction, db, event_id, delta)
+            return chunk_updated, chunk_unchanged, chunk_errors
+
+        for start in range(0, len(pending), GUESTS_PER_TRANSACTION):
+            chunk_updated, chunk_unchanged, chunk_errors = _update_chunk(db.transaction(), pending[start:start + GUESTS_PER_TRANSACTION])
+            updated_guests.extend(chunk_updated)
+            unchanged_guests.extend(chunk_unchanged)
+            errors.extend(chunk_errors)
 
         # Если есть ошибки, возвращаем их
         if errors:
@@ -266,7 +330,7 @@ def update_guest_list(data, db):
 
         # Возвращаем успешный ответ
         return default_response(
-            {"message": f"{len(updated_guests)} guests updated successfully", "updated_guests": updated_guests},
+            {"message": f"{len(updated_guests)} guests updated successfully", "updated_guests": updated_guests, "unchanged_guests": unchanged_guests},
             200
         )
 
@@ -285,41 +349,39 @@ def delete_guest(data, db):
         if not user_id:
             return default_error_response("User ID not found", 400)
 
-        # Валидация пользователя
-        user_error = validate_user(user_id, db)
-        if user_error:
-            return user_error
-
         if not guest_id or not event_id:
             return validation_error_response("Guest ID and Event ID are required", 400)
 
-        # Валидация существования гостя
+        user_ref = db.collection("users").document(user_id)
         guest_ref = db.collection("guests").document(guest_id)
-        guest_doc = guest_ref.get()
+        event_ref = db.collection("events").document(event_id)  # Создаем ссылку на документ события
 
-        if not guest_doc.exists:
-            return validation_error_response("Guest not found", 404)
+        # Пользователь, гость и событие читаются одним get_all; проверка и удаление - в той же транзакции
+        @firestore.transactional
+        def _delete(transaction):
+            user_doc, guest_doc, event_doc = get_all_in_transaction(transaction, [user_ref, guest_ref, event_ref])
 
-        # Валидация события
-        event_doc = validate_event(event_id, db)  # Теперь возвращаем сам документ события
-        if isinstance(event_doc, dict):  # Если возвращен словарь с ошибкой
-            return event_doc  # Возвращаем ошибку, если событие не найдено
+            if not user_doc.exists:
+                return default_error_response("User not found in Firestore", 404)
+            # Гость должен принадлежать тому событию, права на которое проверяем
+            if not guest_doc.exists or guest_doc.to_dict().get("eventId") != event_id:
+                return validation_error_response("Guest not found", 404)
 
-        event_ref = db.collection("events").document(event_id)  # Создаем ссылку на документ события
-        event_data = event_doc.to_dict()  # Преобразуем документ в словарь
+            permission_error = check_event_access(user_id, user_doc, event_doc)
+            if permission_error:
+                return permission_error
 
-        # Валидация разрешений пользователя для события
-        permission_error = validate_permission(user_id, event_doc, db)
-        if permission_error:
-            return permission_error
+            # Удаляем ID гостя из списка гостей события
+            transaction.update(event_ref, {"guests": firestore.ArrayRemove([guest_id])})
 
-        # Удаляем ID гостя из списка гостей события
-        event_ref.update({
-            "guests": firestore.ArrayRemove([guest_id])
-        })
+            # Удаляем самого гостя и вычитаем его из счетчиков события
+            transaction.delete(guest_ref)
+            apply_stats_delta(transaction, db, event_id, stats_delta(old_guest=guest_doc.to_dict()))
+            return None
 
-        # Удаляем самого гостя
-        guest_ref.delete()
+        error = _delete(db.transaction())
+        if error:
+            return error
 
         return default_response({"message": "Guest deleted successfully"}, 200)
 
@@ -341,7 +403,14 @@ def get_guests(data, db):
         # Получаем гостей по айди ивента
         guests_ref = db.collection("guests")
         guests_query = guests_ref.where("eventId", "==", event_id)
-        guests_docs = guests_query.stream()
+
+        # Постраничная выдача, только если клиент передал limit или pageToken
+        paging = page_params(data)
+        if paging:
+            limit, page_token = paging
+            guests_docs, next_page_token = fetch_page(guests_query, f"guests:{event_id}", ["created"], limit, page_token)
+        else:
+            guests_docs = guests_query.stream()
 
         guests = []
         # Проходим по всем отфильтрованным документам и добавляем их в список
@@ -353,11 +422,18 @@ def get_guests(data, db):
 
             guests.append(guest_data)  # Добавляем данные гостя в список
 
+        if paging:
+            # Порядок уже задан запросом: created по убыванию, затем ID
+            return jsonify({"items": guests, "nextPageToken": next_page_token}), 200
+
         guests = sorted(guests, key=lambda g: g.get("created", ""), reverse=True)
 
         # Возвращаем список гостей
         return jsonify(guests), 200  # Возвращаем правильный JSON ответ
 
+    except PageTokenError as e:
+        return validation_error_response(str(e), 400)
+
     except Exception as e:
         return default_error_response(str(e), 500)
 
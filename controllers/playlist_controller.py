@@ -5,6 +5,7 @@ from services.exception_handler import default_error_response, validation_error_
 from services.response_handler import default_response
 from datetime import datetime
 from services.validation import validate_user, validate_playlist
+from services.pagination import page_params, fetch_page, PageTokenError
 
 # Основная логика добавления плейлиста
 def add_playlist(data, db):
@@ -27,7 +28,7 @@ def add_playlist(data, db):
         return default_error_response(str(e), 500)
 
 # Основная логика получения плейлистов
-def get_playlists(db):
+def get_playlists(data, db):
     try:
         user_id = g.user.get("uid")
         # Валидация пользователя
@@ -36,7 +37,15 @@ def get_playlists(db):
             return user_error
 
         playlists_ref = db.collection('playlists')
-        docs = playlists_ref.stream()
+
+        # Постраничная выдача, только если клиент передал limit или pageToken.
+        # У плейлистов нет поля created, поэтому сортируем только по ID документа
+        paging = page_params(data)
+        if paging:
+            limit, page_token = paging
+            docs, next_page_token = fetch_page(playlists_ref, "playlists", [], limit, page_token)
+        else:
+            docs = playlists_ref.stream()
 
         playlists = []
         for doc in docs:
@@ -44,11 +53,17 @@ def get_playlists(db):
             playlist_data["id"] = doc.id
             playlists.append(playlist_data)
 
+        if paging:
+            return jsonify({"items": playlists, "nextPageToken": next_page_token}), 200
+
         if playlists:
             return jsonify(playlists), 200
         else:
             return default_error_response("No playlists found", 404)
 
+    except PageTokenError as e:
+        return validation_error_response(str(e), 400)
+
     except Exception as e:
         return default_error_response(str(e), 500)
 
@@ -1,6 +1,6 @@
 from flask import Blueprint, request, jsonify, current_app, g
 from .guest_controller import add_guest, add_guest_auth, update_guest, update_guest_list, delete_guest, get_guests, get_drinks, get_tags, get_visit_sts
-from .event_controller import add_event, update_todo, get_events, get_event_by_id, delete_event, update_event, get_event_designs
+from .event_controller import add_event, update_todo, update_todo_items, get_events, get_event_by_id, delete_event, update_event, get_event_designs, get_event_stats, get_delete_event_status, get_event_feed
 from .playlist_controller import add_playlist, get_playlists, get_playlist_by_id, delete_playlist, update_playlist  # Добавьте этот импорт
 from .users_controller import add_allowed_user, search_users, remove_allowed_user
 from .yandex_parser import parse_yandex_music_track
@@ -94,12 +94,19 @@ def update_todo_route():
     return update_todo(request.json, db)  # Передаем db как аргумент
 
 
+# Маршрут для точечных операций над todo (add, toggle, rename, remove, move)
+@event_routes.route('/api/events/todo_ops', methods=['POST'])
+@authenticate_request
+def update_todo_items_route():
+    db = current_app.db  # Получаем объект db из текущего приложения
+    return update_todo_items(request.json, db)  # Передаем request.json как аргумент
+
 # Маршрут для получения списка events
 @event_routes.route('/api/events/list', methods=['POST'])
 @authenticate_request
 def get_events_route():
     db = current_app.db  # Получаем объект db из текущего приложения
-    return get_events(db)  # Передаем request.json как аргумент
+    return get_events(request.get_json(silent=True) or {}, db)  # Тело запроса необязательно
 
 # Маршрут для получения event по id
 @event_routes.route('/api/events/id', methods=['POST'])
@@ -108,6 +115,20 @@ def get_event_by_id_route():
     db = current_app.db  # Получаем объект db из текущего приложения
     return get_event_by_id(request.json, db)  # Передаем request.json как аргумент
 
+# Маршрут для получения счетчиков гостей event
+@event_routes.route('/api/events/stats', methods=['POST'])
+@authenticate_request
+def get_event_stats_route():
+    db = current_app.db  # Получаем объект db из текущего приложения
+    return get_event_stats(request.json, db)  # Передаем request.json как аргумент
+
+# Поток изменений event и его гостей (Server-Sent Events)
+@event_routes.route('/api/events/feed', methods=['GET'])
+@authenticate_request
+def get_event_feed_route():
+    db = current_app.db  # Получаем объект db из текущего приложения
+    return get_event_feed(request.args.get('eventId'), db)  # EventSource умеет только GET, поэтому eventId в query
+
 # Маршрут для удаления event
 @event_routes.route('/api/events/delete', methods=['POST'])
 @authenticate_request
@@ -115,6 +136,13 @@ def delete_event_route():
     db = current_app.db  # Получаем объект db из текущего приложения
     return delete_event(request.json, db)  # Передаем request.json как аргумент
 
+# Маршрут для статуса фонового удаления event
+@event_routes.route('/api/events/delete_status', methods=['POST'])
+@authenticate_request
+def get_delete_event_status_route():
+    db = current_app.db  # Получаем объект db из текущего приложения
+    return get_delete_event_status(request.json, db)  # Передаем request.json как аргумент
+
 # Маршрут для обновленния event
 @event_routes.route('/api/events/update', methods=['POST'])
 @authenticate_request
@@ -186,7 +214,7 @@ def add_playlist_route():
 @authenticate_request
 def get_playlists_route():
     db = current_app.db  # Получаем объект db из текущего приложения
-    return get_playlists(db)  # Передаем request.json как аргумент
+    return get_playlists(request.get_json(silent=True) or {}, db)  # Тело запроса необязательно
 
 # Маршрут для получения плейлиста по id
 @playlist_routes.route('/api/playlists/id', methods=['POST'])
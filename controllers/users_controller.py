@@ -5,7 +5,8 @@ from models.todo import Todo
 from services.exception_handler import default_error_response, validation_error_response
 from services.response_handler import default_response
 from datetime import datetime
-from services.validation import validate_user, validate_event, validate_permission, validate_guest_phone
+from services.loader import get_loader
+from services.validation import validate_user, validate_event, validate_permission, validate_guest_phone, invalidate_event_permissions
 
 
 def search_users(data, db):
@@ -69,6 +70,11 @@ def add_allowed_user(data, db):
         if not event_id or not adding_user_id:
             return validation_error_response("Missing eventId or adding_user_id", 400)
 
+        # Событие и добавляемый пользователь будут прочитаны одним get_all
+        loader = get_loader(db)
+        loader.prefetch("events", [event_id])
+        loader.prefetch("users", [adding_user_id])
+
         # Валидация события
         event_doc = validate_event(event_id, db)
         if isinstance(event_doc, dict):  # Ошибка
@@ -87,7 +93,7 @@ def add_allowed_user(data, db):
             return default_response({"message": "User is already allowed"}, 200)
 
         # Получение данных нового пользователя
-        new_user_doc = db.collection("users").document(adding_user_id).get()
+        new_user_doc = loader.load("users", adding_user_id)
         if not new_user_doc.exists:
             return validation_error_response("User to add not found", 404)
 
@@ -104,8 +110,10 @@ def add_allowed_user(data, db):
         # Обновляем только поле allowedUsers
         event_doc.reference.update({
             "allowedUsers": current_allowed_users,
+            "allowedUserIds": [user.get("id") for user in current_allowed_users],
             "updated": datetime.utcnow()
         })
+        invalidate_event_permissions(event_id)
 
         return default_response({"message": "User added to allowedUsers"}, 200)
 
@@ -155,8 +163,10 @@ def remove_allowed_user(data, db):
         # Обновляем только поле allowedUsers
         event_doc.reference.update({
             "allowedUsers": updated_allowed_users,
+            "allowedUserIds": [user.get("id") for user in updated_allowed_users],
             "updated": datetime.utcnow()
         })
+        invalidate_event_permissions(event_id)
 
         return default_response({"message": "User removed from allowedUsers"}, 200)
 
@@ -30,6 +30,7 @@ class EventCreate(BaseModel):
     guests: List[str] = []
     todoList: List[Todo] = []
     allowedUsers: List[User] = []
+    allowedUserIds: List[str] = []  # ID из allowedUsers, для запроса array_contains
     playlistLink: str
     eventInvite: Invite
 
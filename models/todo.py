@@ -1,6 +1,15 @@
 from pydantic import BaseModel
+from typing import Optional, Literal
 
 class Todo(BaseModel):
     id: str
     name: str
-    completed: bool
\ No newline at end of file
+    completed: bool
+
+# Одна операция над пунктом todoList (см. /api/events/todo_ops)
+class TodoOperation(BaseModel):
+    op: Literal["add", "toggle", "rename", "remove", "move"]
+    id: Optional[str] = None  # Для add необязателен - сгенерируется на сервере
+    name: Optional[str] = None  # add, rename
+    completed: Optional[bool] = None  # add, toggle (без значения - переключить)
+    position: Optional[int] = None  # add, move
@@ -0,0 +1,49 @@
+"""
+Разовое заполнение поля allowedUserIds у уже существующих событий (из allowedUsers).
+Без него события не попадут в выборку array_contains в /api/events/list.
+
+Запуск из корня проекта (нужен serviceAccountKey.json):
+    python -m scripts.backfill_allowed_user_ids
+"""
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+# Лимит операций в одном batch Firestore
+BATCH_SIZE = 500
+
+
+def backfill_allowed_user_ids(db):
+    updated = 0
+    skipped = 0
+    batch = db.batch()
+    pending = 0
+
+    for event in db.collection('events').select(['allowedUsers', 'allowedUserIds']).stream():
+        event_data = event.to_dict()
+        allowed_user_ids = [user.get('id') for user in event_data.get('allowedUsers', []) if user.get('id')]
+
+        if event_data.get('allowedUserIds') == allowed_user_ids:
+            skipped += 1
+            continue
+
+        batch.update(event.reference, {'allowedUserIds': allowed_user_ids})
+        pending += 1
+        updated += 1
+
+        if pending == BATCH_SIZE:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+
+    if pending:
+        batch.commit()
+
+    return updated, skipped
+
+
+if __name__ == '__main__':
+    cred = credentials.Certificate('serviceAccountKey.json')
+    firebase_admin.initialize_app(cred)
+
+    updated, skipped = backfill_allowed_user_ids(firestore.client())
+    print(f"Обновлено событий: {updated}, пропущено: {skipped}")
@@ -0,0 +1,51 @@
+"""
+Разовое заполнение индекса usernames/{username_lower} для уже существующих пользователей.
+
+Запуск из корня проекта (нужен serviceAccountKey.json):
+    python -m scripts.backfill_usernames
+"""
+import firebase_admin
+from firebase_admin import credentials, firestore
+from google.api_core.exceptions import AlreadyExists
+from auth.usernames import USERNAMES_COLLECTION, username_key
+
+
+def backfill_usernames(db):
+    created = 0
+    skipped = 0
+    conflicts = []
+
+    for user in db.collection('users').select(['username']).stream():
+        username = user.to_dict().get('username')
+        if not username:
+            skipped += 1
+            continue
+
+        try:
+            claim_ref = db.collection(USERNAMES_COLLECTION).document(username_key(username))
+        except ValueError:
+            conflicts.append((user.id, username, "invalid username"))
+            continue
+
+        try:
+            # create() не перезаписывает существующую запись
+            claim_ref.create({"uid": user.id, "username": username})
+            created += 1
+        except AlreadyExists:
+            owner = claim_ref.get().get('uid')
+            if owner == user.id:
+                skipped += 1
+            else:
+                conflicts.append((user.id, username, f"already claimed by {owner}"))
+
+    return created, skipped, conflicts
+
+
+if __name__ == '__main__':
+    cred = credentials.Certificate('serviceAccountKey.json')
+    firebase_admin.initialize_app(cred)
+
+    created, skipped, conflicts = backfill_usernames(firestore.client())
+    print(f"Создано записей: {created}, пропущено: {skipped}, конфликтов: {len(conflicts)}")
+    for user_id, username, reason in conflicts:
+        print(f"  {user_id} ({username}): {reason}")
@@ -0,0 +1,31 @@
+"""
+Пересчет счетчиков гостей событий (events/{id}/stats) по коллекции guests.
+Нужен один раз для уже существующих событий и при расхождении счетчиков.
+
+Запуск из корня проекта (нужен serviceAccountKey.json):
+    python -m scripts.rebuild_event_stats            # все события
+    python -m scripts.rebuild_event_stats ID1 ID2    # только указанные
+"""
+import sys
+import firebase_admin
+from firebase_admin import credentials, firestore
+from services.event_stats import rebuild_event_stats
+
+
+def rebuild_all(db, event_ids=None):
+    if not event_ids:
+        event_ids = [event.id for event in db.collection('events').select([]).stream()]
+
+    for event_id in event_ids:
+        stats = rebuild_event_stats(db, event_id)
+        print(f"{event_id}: гостей {stats['total']}")
+
+    return len(event_ids)
+
+
+if __name__ == '__main__':
+    cred = credentials.Certificate('serviceAccountKey.json')
+    firebase_admin.initialize_app(cred)
+
+    count = rebuild_all(firestore.client(), sys.argv[1:])
+    print(f"Пересчитано событий: {count}")
@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BackgroundJobs:
+    """
+    Фоновые задачи, которые не стоит выполнять в потоке запроса (например, удаление большого события).
+    Статус хранится в памяти процесса: его видит только воркер, принявший задачу.
+    """
+
+    def __init__(self, max_workers=2, result_ttl=3600):
+        self.result_ttl = result_ttl  # Сколько секунд хранить статус завершенной задачи
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='background-job')
+
+    def submit(self, kind, owner, fn, *args):
+        """
+        Ставит fn(*args, progress=...) в очередь и сразу возвращает ID задачи.
+        owner - uid пользователя, которому разрешено смотреть статус.
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._purge_finished()
+            self._jobs[job_id] = {
+                "id": job_id,
+                "kind": kind,
+                "owner": owner,
+                "status": "queued",
+                "progress": 0,
+                "result": None,
+                "error": None,
+                "created": time.time(),
+                "finished": None,
+            }
+        self._executor.submit(self._run, job_id, fn, args)
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _run(self, job_id, fn, args):
+        self._update(job_id, status="running")
+        try:
+            result = fn(*args, progress=lambda done: self._update(job_id, progress=done))
+        except Exception as e:
+            print(f"Ошибка фоновой задачи {job_id}: {e}")
+            self._update(job_id, status="failed", error=str(e), finished=time.time())
+        else:
+            self._update(job_id, status="done", result=result, finished=time.time())
+
+    def _purge_finished(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items() if job["finished"] and now - job["finished"] > self.result_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+background_jobs = BackgroundJobs(
+    max_workers=int(os.getenv('BACKGROUND_JOB_WORKERS', 2)),
+    result_ttl=int(os.getenv('BACKGROUND_JOB_RESULT_TTL', 3600)),
+)
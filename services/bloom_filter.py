@@ -0,0 +1,64 @@
+import hashlib
+import math
+import threading
+
+
+class BloomFilter:
+    """
+    Bloom-фильтр фиксированного размера: "нет" - точно нет, "есть" - возможно есть.
+    Размер битового массива и число хешей считаются из capacity и error_rate.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError("capacity must be positive and error_rate must be in (0, 1)")
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, item):
+        # Двойное хеширование: k позиций из двух 64-битных половин одного blake2b
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        positions = self._positions(item)
+        with self._lock:
+            added = False
+            for position in positions:
+                byte, bit = divmod(position, 8)
+                if not self._bits[byte] & (1 << bit):
+                    self._bits[byte] |= 1 << bit
+                    added = True
+            if added:
+                self.count += 1
+
+    def __contains__(self, item):
+        bits = self._bits
+        for position in self._positions(item):
+            byte, bit = divmod(position, 8)
+            if not bits[byte] & (1 << bit):
+                return False
+        return True
+
+    def estimated_error_rate(self):
+        # Ожидаемая доля ложных срабатываний при текущем заполнении
+        return (1 - math.exp(-self.hash_count * self.count / self.size)) ** self.hash_count
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "items": self.count,
+            "target_error_rate": self.error_rate,
+            "estimated_error_rate": self.estimated_error_rate(),
+            "hash_count": self.hash_count,
+            "bits": self.size,
+            "memory_bytes": len(self._bits),
+        }
@@ -0,0 +1,242 @@
+import json
+import os
+import queue
+import threading
+from datetime import datetime
+
+# Сколько дельт может ждать отправки одному клиенту; при переполнении клиент получает resync
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv('CHANGE_FEED_QUEUE_SIZE', 100))
+# Интервал heartbeat-комментариев, чтобы прокси не закрывали простаивающее соединение
+HEARTBEAT_INTERVAL = int(os.getenv('CHANGE_FEED_HEARTBEAT', 15))
+
+# Служебные поля, изменения которых клиенту не нужны
+IGNORED_EVENT_FIELDS = {'updated'}
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _changed(old, new):
+    # Верхнеуровневые поля, которые изменились или появились
+    return {key: value for key, value in new.items() if key not in old or old[key] != value}
+
+
+class Subscription:
+    def __init__(self, watch, user_id, is_admin):
+        self.watch = watch
+        self.user_id = user_id
+        self.is_admin = is_admin
+        self.closed = False
+        self._queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        # Слушатели события и гостей вызывают push из разных потоков
+        self._push_lock = threading.Lock()
+
+    def push(self, message):
+        with self._push_lock:
+            try:
+                self._queue.put_nowait(message)
+                return
+            except queue.Full:
+                # Клиент не успевает читать: выбрасываем накопленное и просим перечитать событие целиком
+                self._drain()
+                self._queue.put_nowait({"type": "resync"})
+        self.watch.feed.record_overflow()
+
+    def _drain(self):
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def get(self, timeout):
+        return self._queue.get(timeout=timeout)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.watch.unsubscribe(self)
+
+
+class EventWatch:
+    """
+    Один набор слушателей Firestore (документ события и его гости) на событие,
+    общий для всех подключенных клиентов этого события.
+    """
+
+    def __init__(self, feed, db, event_id):
+        self.feed = feed
+        self.event_id = event_id
+        self.sequence = 0
+        self._subscribers = set()
+        self._event_data = None
+        self._guests = None
+        self._lock = threading.Lock()
+        self._event_listener = db.collection('events').document(event_id).on_snapshot(self._on_event)
+        self._guests_listener = db.collection('guests').where('eventId', '==', event_id).on_snapshot(self._on_guests)
+
+    def subscribe(self, user_id, is_admin):
+        subscription = Subscription(self, user_id, is_admin)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            empty = not self._subscribers
+        if empty:
+            self.feed.release(self)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def stop(self):
+        self._event_listener.unsubscribe()
+        self._guests_listener.unsubscribe()
+
+    def _publish(self, message, only=None):
+        with self._lock:
+            self.sequence += 1
+            message["seq"] = self.sequence
+            subscribers = list(only if only is not None else self._subscribers)
+        for subscription in subscribers:
+            subscription.push(message)
+        self.feed.record_published(len(subscribers))
+
+    def _on_event(self, snapshots, changes, read_time):
+        snapshot = snapshots[0] if snapshots else None
+        if snapshot is None or not snapshot.exists:
+            self._publish({"type": "event_deleted", "eventId": self.event_id})
+            return
+
+        new_data = snapshot.to_dict()
+        old_data, self._event_data = self._event_data, new_data
+        # Первый снимок - исходное состояние, клиент уже получил его обычным запросом
+        if old_data is None:
+            return
+
+        changed = {key: value for key, value in _changed(old_data, new_data).items() if key not in IGNORED_EVENT_FIELDS}
+        removed = [key for key in old_data if key not in new_data and key not in IGNORED_EVENT_FIELDS]
+        # Список ID гостей меняется вместе с гостями, о которых придут отдельные дельты
+        changed.pop("guests", None)
+        if changed or removed:
+            self._publish({"type": "event_updated", "changed": changed, "removed": removed})
+
+        if "allowedUserIds" in changed:
+            self._revoke_access(new_data.get("allowedUserIds", []))
+
+    def _revoke_access(self, allowed_user_ids):
+        with self._lock:
+            revoked = [s for s in self._subscribers if not s.is_admin and s.user_id not in allowed_user_ids]
+        if revoked:
+            self._publish({"type": "access_revoked"}, only=revoked)
+
+    def _on_guests(self, snapshots, changes, read_time):
+        # Первый вызов содержит всех текущих гостей как ADDED - запоминаем их без рассылки
+        if self._guests is None:
+            self._guests = {snapshot.id: snapshot.to_dict() for snapshot in snapshots}
+            return
+
+        for change in changes:
+            guest_id = change.document.id
+            change_type = change.type.name
+            if change_type == 'REMOVED':
+                self._guests.pop(guest_id, None)
+                self._publish({"type": "guest_removed", "guestId": guest_id})
+                continue
+
+            new_data = change.document.to_dict()
+            old_data = self._guests.get(guest_id)
+            self._guests[guest_id] = new_data
+            if change_type == 'ADDED' or old_data is None:
+                self._publish({"type": "guest_added", "guest": {**new_data, "id": guest_id}})
+            else:
+                changed = _changed(old_data, new_data)
+                changed.pop("updated", None)
+                if changed:
+                    self._publish({"type": "guest_updated", "guestId": guest_id, "changed": changed})
+
+
+class ChangeFeed:
+    """Реестр EventWatch: слушатель события создается с первым клиентом и снимается с последним."""
+
+    def __init__(self):
+        self.published = 0
+        self.overflows = 0
+        self._watches = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, db, event_id, user_id, is_admin=False):
+        with self._lock:
+            watch = self._watches.get(event_id)
+            if watch is not None:
+                return watch.subscribe(user_id, is_admin)
+
+        # Слушатели Firestore открываются без lock, чтобы не задерживать клиентов других событий
+        new_watch = EventWatch(self, db, event_id)
+        with self._lock:
+            watch = self._watches.setdefault(event_id, new_watch)
+            subscription = watch.subscribe(user_id, is_admin)
+        # Пока открывали слушатели, другой клиент уже создал watch для этого события
+        if watch is not new_watch:
+            new_watch.stop()
+        return subscription
+
+    def release(self, watch):
+        with self._lock:
+            # Пока ждали lock, мог подключиться новый клиент
+            if self._watches.get(watch.event_id) is not watch or watch.subscriber_count():
+                return
+            del self._watches[watch.event_id]
+        watch.stop()
+
+    def record_published(self, count):
+        with self._lock:
+            self.published += count
+
+    def record_overflow(self):
+        with self._lock:
+            self.overflows += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "watched_events": len(self._watches),
+                "subscribers": sum(watch.subscriber_count() for watch in self._watches.values()),
+                "published": self.published,
+                "overflows": self.overflows,
+            }
+
+
+def stream(db, event_id, user_id, is_admin=False):
+    """
+    Генератор text/event-stream для одного клиента: дельты, heartbeat-комментарии
+    и закрытие потока после event_deleted или access_revoked.
+    Подписка создается при первом next(): генератор, закрытый до старта, ничего не оставляет в реестре.
+    """
+    subscription = change_feed.subscribe(db, event_id, user_id, is_admin)
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                message = subscription.get(timeout=HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+                continue
+
+            payload = json.dumps(message, default=_json_default, ensure_ascii=False)
+            yield f"id: {message.get('seq', '')}\nevent: {message['type']}\ndata: {payload}\n\n"
+
+            if message["type"] in ("event_deleted", "access_revoked"):
+                return
+    finally:
+        # Клиент отключился (GeneratorExit) или поток завершен сервером
+        subscription.close()
+
+
+change_feed = ChangeFeed()
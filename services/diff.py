@@ -0,0 +1,37 @@
+from datetime import datetime, timezone
+from google.cloud.firestore_v1.field_path import FieldPath
+
+
+def _normalize(value):
+    # Firestore возвращает datetime с таймзоной, а модели часто дают наивный UTC (datetime.utcnow())
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def _diff(current, update, path, changes):
+    for key, new_value in update.items():
+        field_path = path + (key,)
+        old_value = current.get(key) if isinstance(current, dict) else None
+
+        # Во вложенный объект спускаемся, только если набор ключей тот же:
+        # иначе старые ключи остались бы в документе, а раньше объект заменялся целиком
+        if isinstance(new_value, dict) and isinstance(old_value, dict) and new_value.keys() == old_value.keys():
+            _diff(old_value, new_value, field_path, changes)
+        elif key not in (current or {}) or _normalize(old_value) != _normalize(new_value):
+            changes[FieldPath(*field_path).to_api_repr()] = new_value
+
+
+def changed_fields(current, update):
+    """
+    Какие поля update отличаются от сохраненного документа current.
+    Возвращает словарь {путь поля: новое значение} для document.update(); пустой - писать нечего.
+    Списки сравниваются и пишутся целиком, вложенные объекты - по отдельным полям.
+    """
+    changes = {}
+    _diff(current or {}, update, (), changes)
+    return changes
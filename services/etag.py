@@ -0,0 +1,35 @@
+import hashlib
+import json
+from flask import request, make_response
+
+def _update_time(doc):
+    return doc.update_time.isoformat() if doc is not None and doc.exists and doc.update_time else ""
+
+
+def event_etag(event_doc, stats_shards, variant=None):
+    """
+    ETag события: время последней записи документа события и шардов его счетчиков
+    (при каждой записи гостя пишется один из шардов) в Firestore
+    и вариант ответа (view/fields/include), так как от них зависит тело.
+    """
+    shard_times = ",".join(_update_time(shard) for shard in sorted(stats_shards, key=lambda shard: shard.reference.path))
+    variant_key = json.dumps(variant or {}, sort_keys=True, default=str)
+    return hashlib.sha256(f"{_update_time(event_doc)}|{shard_times}|{variant_key}".encode('utf-8')).hexdigest()[:32]
+
+
+def etag_matches(etag):
+    return etag in request.if_none_match
+
+
+def not_modified_response(etag):
+    response = make_response('', 304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def with_etag(response, etag):
+    # no-cache: клиент может хранить ответ, но обязан перепроверять его по If-None-Match
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,58 @@
+from services.event_stats import STATS_COLLECTION
+
+# Лимит Firestore - 500 операций на одну batch
+DELETE_BATCH_SIZE = 500
+
+
+def _delete_in_batches(db, refs, progress=None):
+    # Удаляет документы пачками по DELETE_BATCH_SIZE; возвращает число удаленных
+    deleted = 0
+    batch = db.batch()
+    pending = 0
+
+    for ref in refs:
+        batch.delete(ref)
+        pending += 1
+        if pending == DELETE_BATCH_SIZE:
+            batch.commit()
+            deleted += pending
+            batch = db.batch()
+            pending = 0
+            if progress:
+                progress(deleted)
+
+    if pending:
+        batch.commit()
+        deleted += pending
+        if progress:
+            progress(deleted)
+
+    return deleted
+
+
+def delete_event_cascade(db, event_id, progress=None):
+    """
+    Удаляет гостей события, его счетчики и сам документ события batch-записями.
+    Событие сначала помечается deleting (validate_event больше не пускает к нему новых гостей),
+    а удаляется последним: если процесс прервется, повторный вызов доудалит остальное.
+    progress(deleted) вызывается после каждой записанной пачки гостей.
+    """
+    event_ref = db.collection('events').document(event_id)
+    event_ref.update({"deleting": True})
+
+    # Гость, добавленный до пометки, мог записаться уже после нашего запроса -
+    # повторяем проходы, пока запрос не вернет ни одного гостя
+    guests_query = db.collection('guests').where('eventId', '==', event_id).select([])
+    deleted_guests = 0
+    while True:
+        # select([]) - читаем только ссылки на документы, без данных гостей
+        guest_refs = (guest.reference for guest in guests_query.stream())
+        pass_progress = (lambda count: progress(deleted_guests + count)) if progress else None
+        deleted = _delete_in_batches(db, guest_refs, pass_progress)
+        if not deleted:
+            break
+        deleted_guests += deleted
+
+    _delete_in_batches(db, list(event_ref.collection(STATS_COLLECTION).list_documents()) + [event_ref])
+
+    return deleted_guests
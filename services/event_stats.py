@@ -0,0 +1,118 @@
+import os
+import random
+from collections import Counter
+from google.cloud import firestore
+
+# Счетчики гостей события: events/{eventId}/stats/shard_{n}.
+# Шарды нужны, чтобы частые записи в одно «горячее» событие не упирались в лимит записей в документ
+STATS_COLLECTION = 'stats'
+STATS_SHARDS = int(os.getenv('EVENT_STATS_SHARDS', 4))
+
+# Версия шарда: увеличивается при каждой записи гостя в этот шард,
+# чтобы ETag события менялся без записи в сам документ события
+GUESTS_VERSION_FIELD = 'guestsVersion'
+
+# Группы счетчиков в документе шарда (помимо общего total)
+COUNTER_GROUPS = ('byStatus', 'byTag', 'byDrink')
+
+
+def _guest_keys(guest_data):
+    # Ключи счетчиков, в которые входит гость: (группа, ключ)
+    keys = [('total', None)]
+
+    status = guest_data.get('guestStatus')
+    if status:
+        keys.append(('byStatus', status))
+
+    tag = guest_data.get('guestTag') or {}
+    if tag.get('id'):
+        keys.append(('byTag', tag['id']))
+
+    for drink in guest_data.get('guestDrinks') or []:
+        if drink.get('id'):
+            keys.append(('byDrink', drink['id']))
+
+    return keys
+
+
+def stats_delta(old_guest=None, new_guest=None):
+    """
+    Изменение счетчиков при записи гостя: old_guest - данные до записи (None при добавлении),
+    new_guest - после (None при удалении). Нулевые изменения отбрасываются.
+    """
+    delta = Counter()
+    if old_guest:
+        delta.subtract(_guest_keys(old_guest))
+    if new_guest:
+        delta.update(_guest_keys(new_guest))
+    return Counter({key: value for key, value in delta.items() if value})
+
+
+def _shard_ref(db, event_id, shard):
+    return db.collection('events').document(event_id).collection(STATS_COLLECTION).document(f'shard_{shard}')
+
+
+def stats_shard_refs(db, event_id):
+    # Ссылки на все шарды события (несозданные шарды читаются как exists == False)
+    return [_shard_ref(db, event_id, shard) for shard in range(STATS_SHARDS)]
+
+
+def apply_stats_delta(writer, db, event_id, delta):
+    """
+    Добавляет изменение счетчиков в ту же batch или транзакцию (writer), что и запись гостя.
+    Пишется в случайный шард через set(merge=True) + Increment, без чтения;
+    guestsVersion шарда растет даже при пустом delta.
+    """
+    update = {GUESTS_VERSION_FIELD: firestore.Increment(1)}
+    for (group, key), value in delta.items():
+        if not value:
+            continue
+        if group == 'total':
+            update['total'] = firestore.Increment(value)
+        else:
+            update.setdefault(group, {})[key] = firestore.Increment(value)
+
+    writer.set(_shard_ref(db, event_id, random.randrange(STATS_SHARDS)), update, merge=True)
+
+
+def read_event_stats(db, event_id):
+    # Сумма по всем шардам события, прочитанным одним get_all
+    total = 0
+    groups = {group: Counter() for group in COUNTER_GROUPS}
+
+    for shard in db.get_all(stats_shard_refs(db, event_id)):
+        shard_data = shard.to_dict() or {}
+        total += shard_data.get('total', 0)
+        for group in COUNTER_GROUPS:
+            groups[group].update(shard_data.get(group) or {})
+
+    result = {"total": total}
+    for group, counter in groups.items():
+        result[group] = {key: value for key, value in counter.items() if value}
+    return result
+
+
+def rebuild_event_stats(db, event_id):
+    """
+    Пересчет счетчиков события с нуля по коллекции guests: итог пишется в shard_0,
+    остальные документы подколлекции stats удаляются.
+    Нужен для событий, созданных до появления счетчиков, и для исправления расхождений.
+    """
+    delta = Counter()
+    for guest in db.collection('guests').where('eventId', '==', event_id).stream():
+        delta.update(_guest_keys(guest.to_dict()))
+
+    stats = {"total": delta.pop(('total', None), 0)}
+    for group in COUNTER_GROUPS:
+        stats[group] = {}
+    for (group, key), value in delta.items():
+        stats[group][key] = value
+
+    batch = db.batch()
+    shard_zero = _shard_ref(db, event_id, 0)
+    batch.set(shard_zero, stats)
+    for shard in db.collection('events').document(event_id).collection(STATS_COLLECTION).list_documents():
+        if shard.id != shard_zero.id:
+            batch.delete(shard)
+    batch.commit()
+    return stats
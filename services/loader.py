@@ -0,0 +1,81 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from flask import g, has_app_context
+
+# Общий пул для параллельного чтения чанков get_all (ограничивает число одновременных RPC)
+_chunk_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('LOADER_MAX_PARALLEL', 4)),
+    thread_name_prefix='loader-chunk',
+)
+
+
+class DocumentLoader:
+    """
+    Загрузчик документов в рамках одного запроса (в духе DataLoader):
+    собирает запрошенные ссылки, убирает дубли и читает их одним db.get_all(),
+    а прочитанные снимки запоминает до конца запроса.
+    """
+
+    def __init__(self, db, chunk_size=100):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.round_trips = 0
+        self._snapshots = {}
+        self._pending = {}
+
+    def prefetch(self, collection, doc_ids):
+        # Только ставит документы в очередь; чтение произойдет при ближайшем load/load_many
+        return self._enqueue([self.db.collection(collection).document(doc_id) for doc_id in doc_ids])
+
+    def load(self, collection, doc_id):
+        return self.load_many(collection, [doc_id])[0]
+
+    def load_many(self, collection, doc_ids):
+        # Снимки в порядке doc_ids, включая несуществующие документы (exists == False)
+        refs = self.prefetch(collection, doc_ids)
+        self.dispatch()
+        return [self._snapshots[ref.path] for ref in refs]
+
+    def dispatch(self):
+        if not self._pending:
+            return
+
+        refs = list(self._pending.values())
+        self._pending.clear()
+        chunks = [refs[start:start + self.chunk_size] for start in range(0, len(refs), self.chunk_size)]
+        self.round_trips += len(chunks)
+
+        if len(chunks) == 1:
+            results = [self._read_chunk(chunks[0])]
+        else:
+            # Несколько чанков читаем параллельно, не больше LOADER_MAX_PARALLEL одновременно
+            results = _chunk_executor.map(self._read_chunk, chunks)
+
+        for snapshots in results:
+            for snapshot in snapshots:
+                self._snapshots[snapshot.reference.path] = snapshot
+
+    def _read_chunk(self, refs):
+        return list(self.db.get_all(refs))
+
+    def _enqueue(self, refs):
+        for ref in refs:
+            if ref.path not in self._snapshots:
+                self._pending[ref.path] = ref
+        return refs
+
+
+def get_loader(db):
+    # Один загрузчик на запрос; вне контекста приложения - новый на каждый вызов
+    if not has_app_context():
+        return DocumentLoader(db)
+    if 'loader' not in g:
+        g.loader = DocumentLoader(db)
+    return g.loader
+
+
+def get_all_in_transaction(transaction, refs):
+    # Чтение нескольких документов одним RPC внутри транзакции; снимки в порядке refs.
+    # В кеш загрузчика не попадают: транзакция может повториться и прочитать их заново
+    snapshots = {snapshot.reference.path: snapshot for snapshot in transaction.get_all(refs)}
+    return [snapshots[ref.path] for ref in refs]
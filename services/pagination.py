@@ -0,0 +1,93 @@
+import base64
+import json
+import os
+from datetime import datetime
+from google.cloud import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+# Верхняя граница limit для всех списков
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 100))
+
+
+class PageTokenError(ValueError):
+    """Некорректный limit или pageToken в запросе."""
+
+
+def page_params(data):
+    """
+    Параметры страницы из тела запроса: (limit, pageToken).
+    None - клиент не просил пагинацию, отдаем весь список как раньше.
+    """
+    limit = data.get('limit')
+    page_token = data.get('pageToken')
+    if limit is None and page_token is None:
+        return None
+
+    if limit is None:
+        limit = MAX_PAGE_SIZE
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise PageTokenError("limit must be an integer")
+    if limit < 1:
+        raise PageTokenError("limit must be positive")
+
+    return min(limit, MAX_PAGE_SIZE), page_token
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and "dt" in value:
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_page_token(scope, values):
+    # scope привязывает токен к конкретному списку (например, гостям одного события)
+    payload = json.dumps({"s": scope, "v": [_encode_value(value) for value in values]}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_page_token(scope, page_token):
+    try:
+        padded = page_token + '=' * (-len(page_token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        values = [_decode_value(value) for value in payload["v"]]
+    except (AttributeError, TypeError, ValueError, KeyError):
+        raise PageTokenError("Invalid pageToken")
+
+    if payload.get("s") != scope:
+        raise PageTokenError("pageToken does not belong to this list")
+    return values
+
+
+def fetch_page(query, scope, order_fields, limit, page_token=None):
+    """
+    Одна страница запроса с сортировкой по order_fields (по убыванию) и ID документа,
+    чтобы порядок был стабильным при одинаковых значениях.
+    Возвращает (документы, токен следующей страницы или None).
+    """
+    order_keys = list(order_fields) + [FieldPath.document_id()]
+    for field in order_keys:
+        query = query.order_by(field, direction=firestore.Query.DESCENDING)
+
+    if page_token:
+        values = decode_page_token(scope, page_token)
+        if len(values) != len(order_keys):
+            raise PageTokenError("Invalid pageToken")
+        query = query.start_after(dict(zip(order_keys, values)))
+
+    # Читаем на один документ больше, чтобы понять, есть ли следующая страница
+    docs = list(query.limit(limit + 1).stream())
+    next_page_token = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_page_token = encode_page_token(scope, [last.get(field) for field in order_fields] + [last.id])
+
+    return docs, next_page_token
@@ -0,0 +1,27 @@
+import os
+from services.cache import TTLCache
+
+# Профили пользователей (users/{uid}) между запросами: проверка сессии = проверка токена + память
+profile_cache = TTLCache(
+    max_size=int(os.getenv('USER_PROFILE_CACHE_SIZE', 10000)),
+    ttl=int(os.getenv('USER_PROFILE_CACHE_TTL', 300)),
+)
+
+
+def get_user_profile(db, user_id):
+    # Данные users/{uid} или None, если документа нет (отсутствие не кешируем)
+    profile = profile_cache.get(user_id)
+    if profile is not None:
+        return profile
+
+    user_doc = db.collection('users').document(user_id).get()
+    if not user_doc.exists:
+        return None
+
+    profile = user_doc.to_dict()
+    profile_cache.set(user_id, profile)
+    return profile
+
+
+def invalidate_user_profile(user_id):
+    profile_cache.invalidate(user_id)
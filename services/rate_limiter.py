@@ -0,0 +1,214 @@
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import wraps
+from flask import request
+from services.exception_handler import default_error_response
+
+try:
+    import redis
+except ImportError:
+    redis = None  # если пакет не установлен, доступен только in-memory backend
+
+
+class RateLimitPolicy:
+    """
+    Token bucket (rate токенов в секунду, не больше burst) плюс
+    скользящее окно: не больше window_limit запросов за window секунд.
+    """
+
+    def __init__(self, rate, burst, window=None, window_limit=None):
+        self.rate = rate
+        self.burst = burst
+        self.window = window
+        self.window_limit = window_limit
+
+
+class InMemoryBackend:
+    # Состояние лимитов в памяти процесса (у каждого воркера свое).
+    # Не больше max_keys ключей: при переполнении вытесняется ключ, к которому дольше всего не обращались
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key, policy, now):
+        # Возвращает (разрешено, через сколько секунд повторить)
+        with self._lock:
+            if key in self._buckets:
+                self._buckets.move_to_end(key)
+            elif len(self._buckets) >= self.max_keys:
+                self._evict_oldest()
+
+            tokens, updated = self._buckets.get(key, (policy.burst, now))
+            tokens = min(policy.burst, tokens + (now - updated) * policy.rate)
+
+            if policy.window_limit:
+                window_start, current, previous = self._windows.get(key, (now - now % policy.window, 0, 0))
+                # Сдвигаем окно, если текущее уже закончилось
+                elapsed_windows = int((now - window_start) // policy.window)
+                if elapsed_windows >= 1:
+                    previous = current if elapsed_windows == 1 else 0
+                    current = 0
+                    window_start += elapsed_windows * policy.window
+                # Оценка числа запросов за последние window секунд
+                weight = 1 - (now - window_start) / policy.window
+                estimated = previous * weight + current
+            else:
+                window_start, current, previous, estimated = None, 0, 0, 0
+
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return False, (1 - tokens) / policy.rate
+
+            if policy.window_limit and estimated + 1 > policy.window_limit:
+                self._buckets[key] = (tokens, now)
+                self._windows[key] = (window_start, current, previous)
+                return False, window_start + policy.window - now
+
+            self._buckets[key] = (tokens - 1, now)
+            if policy.window_limit:
+                self._windows[key] = (window_start, current + 1, previous)
+            return True, 0
+
+    def _evict_oldest(self):
+        key, _ = self._buckets.popitem(last=False)
+        self._windows.pop(key, None)
+
+
+class RedisBackend:
+    # Общее состояние лимитов для всех воркеров; вся логика атомарно выполняется в Lua
+
+    SCRIPT = """
+    local key = KEYS[1]
+    local rate = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local window = tonumber(ARGV[3])
+    local window_limit = tonumber(ARGV[4])
+    local now = tonumber(ARGV[5])
+
+    local state = redis.call('HMGET', key, 'tokens', 'updated', 'wstart', 'cur', 'prev')
+    local tokens = tonumber(state[1]) or burst
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + (now - updated) * rate)
+
+    local wstart = tonumber(state[3]) or (now - now % window)
+    local cur = tonumber(state[4]) or 0
+    local prev = tonumber(state[5]) or 0
+    local elapsed = math.floor((now - wstart) / window)
+    if elapsed >= 1 then
+        if elapsed == 1 then prev = cur else prev = 0 end
+        cur = 0
+        wstart = wstart + elapsed * window
+    end
+    local estimated = prev * (1 - (now - wstart) / window) + cur
+
+    local allowed = 1
+    local retry_after = 0
+    if tokens < 1 then
+        allowed = 0
+        retry_after = (1 - tokens) / rate
+    elseif window_limit > 0 and estimated + 1 > window_limit then
+        allowed = 0
+        retry_after = wstart + window - now
+    else
+        tokens = tokens - 1
+        cur = cur + 1
+    end
+
+    redis.call('HSET', key, 'tokens', tokens, 'updated', now, 'wstart', wstart, 'cur', cur, 'prev', prev)
+    redis.call('EXPIRE', key, math.ceil(math.max(window * 2, burst / rate)))
+    return {allowed, tostring(retry_after)}
+    """
+
+    def __init__(self, url, prefix='ratelimit:'):
+        if redis is None:
+            raise RuntimeError("redis package is not installed")
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    def hit(self, key, policy, now):
+        window = policy.window or 3600
+        allowed, retry_after = self._script(
+            keys=[self.prefix + key],
+            args=[policy.rate, policy.burst, window, policy.window_limit or 0, now],
+        )
+        return bool(allowed), float(retry_after)
+
+
+class RateLimiter:
+    def __init__(self, backend):
+        self.backend = backend
+        self.allowed = 0
+        self.rejected = Counter()
+        self._lock = threading.Lock()
+
+    def check(self, scope, subject, policy):
+        # scope - например "signin:ip", subject - сам IP или email
+        try:
+            allowed, retry_after = self.backend.hit(f"{scope}:{subject}", policy, time.time())
+        except Exception as e:
+            # Недоступный общий backend не должен ронять авторизацию
+            print(f"Ошибка rate limiter: {e}")
+            return True, 0
+
+        with self._lock:
+            if allowed:
+                self.allowed += 1
+            else:
+                # Считаем отказы по scope, без IP и email
+                self.rejected[scope] += 1
+        return allowed, retry_after
+
+    def stats(self):
+        with self._lock:
+            return {
+                "allowed": self.allowed,
+                "rejected": dict(self.rejected),
+                "rejected_total": sum(self.rejected.values()),
+            }
+
+
+def _make_backend():
+    redis_url = os.getenv('RATE_LIMIT_REDIS_URL')
+    if redis_url:
+        return RedisBackend(redis_url)
+    return InMemoryBackend()
+
+
+rate_limiter = RateLimiter(_make_backend())
+
+
+def rate_limit(endpoint, ip_policy, identity_policy=None, identity_field=None):
+    """
+    Лимит запросов по IP и (опционально) по идентификатору из тела запроса, например email.
+    Отказ - дешевый 429 до любой работы с Firestore или Identity Toolkit.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            checks = [(f"{endpoint}:ip", request.remote_addr, ip_policy)]
+
+            if identity_policy and identity_field:
+                data = request.get_json(silent=True) or {}
+                identity = data.get(identity_field) if isinstance(data, dict) else None
+                if isinstance(identity, str) and identity:
+                    checks.append((f"{endpoint}:identity", identity.lower(), identity_policy))
+
+            for scope, subject, policy in checks:
+                allowed, retry_after = rate_limiter.check(scope, subject, policy)
+                if not allowed:
+                    response, status_code = default_error_response("Too many requests", 429)
+                    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                    return response, status_code
+
+            return f(*args, **kwargs)
+
+        return decorated_function
+
+    return decorator
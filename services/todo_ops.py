@@ -0,0 +1,64 @@
+import uuid
+
+
+class TodoOperationError(ValueError):
+    """Операцию нельзя применить к текущему списку (нет пункта, не хватает полей)."""
+
+
+def _find(todo_list, todo_id):
+    for index, todo in enumerate(todo_list):
+        if todo.get("id") == todo_id:
+            return index
+    return None
+
+
+def _clamp(position, size):
+    if position is None:
+        return size
+    return max(0, min(position, size))
+
+
+def apply_todo_operations(todo_list, operations):
+    """
+    Применяет операции (TodoOperation) к копии todoList по порядку и возвращает новый список.
+    add и remove идемпотентны: повтор запроса после сетевой ошибки не создаст дубль и не упадет.
+    """
+    todo_list = [dict(todo) for todo in todo_list]
+
+    for operation in operations:
+        index = _find(todo_list, operation.id) if operation.id else None
+
+        if operation.op == "add":
+            if not operation.name:
+                raise TodoOperationError("name is required for add")
+            if index is not None:
+                continue
+            todo = {"id": operation.id or uuid.uuid4().hex, "name": operation.name, "completed": bool(operation.completed)}
+            todo_list.insert(_clamp(operation.position, len(todo_list)), todo)
+            continue
+
+        if not operation.id:
+            raise TodoOperationError(f"id is required for {operation.op}")
+
+        if operation.op == "remove":
+            if index is not None:
+                todo_list.pop(index)
+            continue
+
+        if index is None:
+            raise TodoOperationError(f"Todo not found: {operation.id}")
+
+        if operation.op == "toggle":
+            current = todo_list[index].get("completed", False)
+            todo_list[index]["completed"] = (not current) if operation.completed is None else operation.completed
+        elif operation.op == "rename":
+            if not operation.name:
+                raise TodoOperationError("name is required for rename")
+            todo_list[index]["name"] = operation.name
+        elif operation.op == "move":
+            if operation.position is None:
+                raise TodoOperationError("position is required for move")
+            todo = todo_list.pop(index)
+            todo_list.insert(_clamp(operation.position, len(todo_list)), todo)
+
+    return todo_list
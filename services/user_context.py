@@ -0,0 +1,9 @@
+from services.loader import get_loader
+
+
+def get_user_doc(user_id, db):
+    """
+    Документ users/{uid}, загруженный не более одного раза за запрос
+    (через загрузчик запроса, вместе с другими документами, если они ждут чтения).
+    """
+    return get_loader(db).load('users', user_id)
@@ -1,22 +1,53 @@
 from firebase_admin import auth
 from google.cloud.firestore import ArrayUnion
 from services.exception_handler import default_error_response
+from services.user_context import get_user_doc
+from services.loader import get_loader
+from services.cache import TTLCache
+import os
+
+# Роль пользователя: uid -> role ("" если роли нет); заодно подтверждает, что пользователь существует
+user_role_cache = TTLCache(max_size=10000, ttl=int(os.getenv('USER_ROLE_CACHE_TTL', 60)))
+
+# Разрешенный доступ к событию: (uid, eventId) -> True. Запреты не кешируем,
+# чтобы добавленный в другом воркере пользователь сразу получал доступ
+permission_cache = TTLCache(max_size=50000, ttl=int(os.getenv('PERMISSION_CACHE_TTL', 30)))
+
+def _get_user_role(user_id, db):
+    # None - пользователя нет в Firestore
+    role = user_role_cache.get(user_id)
+    if role is not None:
+        return role
+
+    user_doc = get_user_doc(user_id, db)
+    if not user_doc.exists:
+        return None
+
+    role = user_doc.to_dict().get("role") or ""
+    user_role_cache.set(user_id, role)
+    return role
+
+def is_admin(user_id, db):
+    return _get_user_role(user_id, db) == "admin"
+
+def invalidate_event_permissions(event_id):
+    # Вызывается при изменении allowedUsers и удалении события
+    permission_cache.invalidate_where(lambda key: key[1] == event_id)
 
 def validate_user(user_id, db):
     if not user_id:
         return default_error_response("User ID not found", 400)
     
-    user_doc = db.collection('users').document(user_id).get()
-    if not user_doc.exists:
+    if _get_user_role(user_id, db) is None:
         return default_error_response("User not found in Firestore", 404)
     
     return None
 
 def validate_event(event_id, db):
-    event_ref = db.collection('events').document(event_id)
-    event_doc = event_ref.get()
+    event_doc = get_loader(db).load('events', event_id)
 
-    if not event_doc.exists:
+    # Событие, которое сейчас удаляется, считаем уже удаленным: к нему нельзя добавить гостей
+    if not event_doc.exists or (event_doc.to_dict() or {}).get("deleting"):
         return default_error_response("Event not found", 404)
 
     return event_doc  # Возвращаем сам объект события, если оно найдено
@@ -24,37 +55,83 @@ def validate_event(event_id, db):
 def validate_permission(user_id, event_doc, db):
     if not user_id:
         return default_error_response("User ID not found", 400)
-    # Проверяем наличие пользователя в Firestore
-    user_doc = db.collection('users').document(user_id).get()
-    if not user_doc.exists:
+    # Проверяем наличие пользователя в Firestore (роль кешируется)
+    role = _get_user_role(user_id, db)
+    if role is None:
         return default_error_response("User not found in Firestore", 404)
     
-    user_data = user_doc.to_dict()
-    
     # Если пользователь админ, разрешаем доступ сразу
-    if user_data.get("role") == "admin":
+    if role == "admin":
         return None
 
-    print(user_id)
+    if permission_cache.get((user_id, event_doc.id)):
+        return None
 
     # Проверяем разрешения на основе allowedUsers
     event_data = event_doc.to_dict()
     allowed_users = event_data.get("allowedUsers", [])
 
-    print(user_id)
+    if not any(user.get("id") == user_id for user in allowed_users):
+        return default_error_response("Access denied: You do not have permission to edit this event", 403)
+
+    permission_cache.set((user_id, event_doc.id), True)
+    return None
+
+def validate_event_permission(user_id, event_id, db):
+    """
+    Проверка прав на событие по его ID. Если решение уже есть в кеше, событие не читается.
+    Возвращает None или ответ с ошибкой.
+    """
+    if not user_id:
+        return default_error_response("User ID not found", 400)
+    if not event_id:
+        return default_error_response("Event ID is required", 400)
+
+    role = _get_user_role(user_id, db)
+    if role is None:
+        return default_error_response("User not found in Firestore", 404)
+
+    if role != "admin" and permission_cache.get((user_id, event_id)):
+        return None
+
+    event_doc = get_loader(db).load('events', event_id)
+    if not event_doc.exists:
+        return default_error_response("Event not found", 404)
+
+    return validate_permission(user_id, event_doc, db)
+
+def check_event_access(user_id, user_doc, event_doc):
+    """
+    Проверка прав по уже прочитанным снимкам пользователя и события, без обращений к Firestore.
+    Используется внутри транзакций, где документы читаются вместе с данными для записи,
+    поэтому решение принимается по свежим данным, а не по кешу; кеши роли и прав
+    при этом обновляются, чтобы ими пользовались следующие запросы на чтение.
+    Возвращает None или ответ с ошибкой.
+    """
+    if not user_doc.exists:
+        return default_error_response("User not found in Firestore", 404)
+
+    role = user_doc.to_dict().get("role") or ""
+    user_role_cache.set(user_id, role)
+
+    if not event_doc.exists:
+        return default_error_response("Event not found", 404)
+
+    if role == "admin":
+        return None
 
+    allowed_users = event_doc.to_dict().get("allowedUsers", [])
     if not any(user.get("id") == user_id for user in allowed_users):
         return default_error_response("Access denied: You do not have permission to edit this event", 403)
 
+    permission_cache.set((user_id, event_doc.id), True)
     return None
 
 def validate_guest_phone(event_data, guest_phone, db):
     existing_guests = event_data.get('guests', [])
     
-    for guest_id in existing_guests:
-        guest_ref = db.collection('guests').document(guest_id)
-        guest_doc = guest_ref.get()
-        
+    # Все гости события читаются одним get_all
+    for guest_doc in get_loader(db).load_many('guests', existing_guests):
         if guest_doc.exists:
             guest_data = guest_doc.to_dict()
             if guest_data.get('guestPhone') == guest_phone: